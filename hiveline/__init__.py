@@ -1,9 +1,32 @@
-from hiveline.mongo.db import get_database, get_place_id
-from hiveline.routing.resource_loader import create_place_resources
-from hiveline.routing.vc_router_wrapper import route_virtual_commuters
-from hiveline.od.place import Place
-from hiveline.vc.generation import create_simulation
-from hiveline.results.modal_shares import plot_monte_carlo_convergence, get_journeys_stats
-from hiveline.results.journeys import Journeys
-from hiveline.results.trace_plotter import plot_traces
-from hiveline.plotting.map import CityPlotter
+import importlib
+
+# the public names are imported on first access, so importing a submodule (e.g. for a routing run) does not load
+# pandas, osmnx, matplotlib etc. through the modules it doesn't use
+_exports = {
+    "get_database": "hiveline.mongo.db",
+    "get_place_id": "hiveline.mongo.db",
+    "create_place_resources": "hiveline.routing.resource_loader",
+    "route_virtual_commuters": "hiveline.routing.vc_router_wrapper",
+    "Place": "hiveline.od.place",
+    "create_simulation": "hiveline.vc.generation",
+    "plot_monte_carlo_convergence": "hiveline.results.modal_shares",
+    "get_journeys_stats": "hiveline.results.modal_shares",
+    "Journeys": "hiveline.results.journeys",
+    "plot_traces": "hiveline.results.trace_plotter",
+    "CityPlotter": "hiveline.plotting.map",
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name):
+    if name not in _exports:
+        raise AttributeError("module 'hiveline' has no attribute '" + name + "'")
+
+    value = getattr(importlib.import_module(_exports[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
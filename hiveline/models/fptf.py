@@ -1,16 +1,30 @@
 import datetime
-import json
+import functools
+import math
+import sys
 from enum import Enum
+from typing import NamedTuple
 
+import numpy as np
+import orjson
 import polyline
 
-supported_formats = ['%Y-%m-%dT%H:%M:%S.%f%z', '%Y-%m-%dT%H:%M:%S%z', '%Y-%m-%dT%H:%M:%S.%f',
-                     '%Y-%m-%dT%H:%M:%S']  # first will be used for formatting
+# fallback formats for time strings that datetime.fromisoformat does not accept, most common first
+supported_formats = ('%Y-%m-%dT%H:%M:%S.%f%z', '%Y-%m-%dT%H:%M:%S%z', '%Y-%m-%dT%H:%M:%S.%f',
+                     '%Y-%m-%dT%H:%M:%S')
 
 
 def _remove_empty_keys(d):
-    """ Remove keys with None or empty values from a dictionary. """
-    return {k: v for k, v in d.items() if v}
+    """ Remove keys with None values from a dictionary. False and 0 are kept, as they are meaningful values. """
+    return {k: v for k, v in d.items() if v is not None}
+
+
+def _intern(value):
+    """
+    Interns a string from a JSON payload. Names, ids, platforms and similar fields repeat across many objects, so
+    parsed objects share one copy of each string.
+    """
+    return sys.intern(value) if type(value) is str else value
 
 
 def read_datetime(time_str):
@@ -23,6 +37,25 @@ def read_datetime(time_str):
         return None
     if isinstance(time_str, datetime.datetime):
         return time_str
+    return _parse_datetime(time_str)
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_datetime(time_str: str):
+    """
+    Parses a time string (see read_datetime). The same times repeat across legs and stopovers, so parsed strings are
+    cached (datetime objects are immutable).
+    :param time_str: The time string.
+    :return: The datetime.datetime object.
+    """
+    try:
+        # the C parser accepts all supported formats that are written by format_datetime. Before Python 3.11 it does
+        # not accept the "Z" suffix of UTC times, so that is spelled out as an offset.
+        iso_str = time_str[:-1] + '+00:00' if time_str.endswith('Z') else time_str
+        return datetime.datetime.fromisoformat(iso_str)
+    except ValueError:
+        pass
+
     for format in supported_formats:
         try:
             return datetime.datetime.strptime(time_str, format)
@@ -41,15 +74,39 @@ def format_datetime(dt):
     """
     if not dt:
         return None
+    return _format_datetime(dt)
+
+
+@functools.lru_cache(maxsize=4096)
+def _format_datetime(dt: datetime.datetime) -> str:
+    """
+    Formats a datetime (see format_datetime). Legs and stopovers share most of their times, so formatted times are
+    cached. Equal datetimes are the same instant, so they always give the same local time string.
+    """
     return dt.astimezone().isoformat()
 
 
+def _json_default(obj):
+    """
+    Serializes fptf objects for orjson. Journeys, legs and stopovers give a dictionary that still contains their
+    nested objects, which orjson passes back here one by one, so the whole tree is never built as dictionaries.
+    Other objects are small and use their to_dict.
+    """
+    if isinstance(obj, (Journey, Leg, Stopover)):
+        return obj._to_json_dict()
+    if hasattr(obj, 'to_dict'):
+        return obj.to_dict()
+    raise TypeError
+
+
 class Location:
     """
     Represents a geographical location in the public transport system.
     It can be used by other items to indicate their locations.
     """
 
+    __slots__ = ('type', 'name', 'address', 'longitude', 'latitude', 'altitude')
+
     def __init__(self, name=None, address=None, longitude=None, latitude=None, altitude=None):
         self.type = 'location'
         self.name = name
@@ -69,15 +126,15 @@ class Location:
         })
 
     def to_json(self):
-        return json.dumps(self.to_dict())
+        return orjson.dumps(self.to_dict()).decode()
 
     @staticmethod
-    def from_dict(json_str):
-        data = json.loads(json_str)
-        return location_from_json(data)
+    def from_json(json_str):
+        data = orjson.loads(json_str)
+        return location_from_dict(data)
 
 
-def location_from_json(data: dict | str | None):
+def location_from_dict(data: dict | str | None):
     """
     Creates a Location object from a JSON object.
     :param data: The JSON dict.
@@ -89,11 +146,11 @@ def location_from_json(data: dict | str | None):
         return Location(name=data)
 
     return Location(
-        name=data['name'] if 'name' in data else None,
-        address=data['address'] if 'address' in data else None,
-        longitude=data['longitude'] if 'longitude' in data else None,
-        latitude=data['latitude'] if 'latitude' in data else None,
-        altitude=data['altitude'] if 'altitude' in data else None
+        name=data.get('name'),
+        address=data.get('address'),
+        longitude=data.get('longitude'),
+        latitude=data.get('latitude'),
+        altitude=data.get('altitude')
     )
 
 
@@ -103,6 +160,8 @@ class Station:
     A station is a larger building or area that can be identified by a name.
     """
 
+    __slots__ = ('type', 'id', 'name', 'location', 'regions')
+
     def __init__(self, id: str, name: str, location: Location = None, regions: list = None):
         self.type = 'station'
         self.id = id
@@ -116,19 +175,20 @@ class Station:
             'id': self.id,
             'name': self.name,
             'location': self.location.to_dict() if self.location else None,
-            'regions': [r.to_dict() for r in self.regions] if self.regions else None
+            # regions are referenced by id, they list their stations themselves (this also breaks the cycle)
+            'regions': [r.id for r in self.regions] if self.regions else None
         })
 
     def to_json(self):
-        return json.dumps(self.to_dict())
+        return orjson.dumps(self.to_dict()).decode()
 
     @staticmethod
     def from_json(json_str):
-        data = json.loads(json_str)
-        return station_from_json(data)
+        data = orjson.loads(json_str)
+        return station_from_dict(data)
 
 
-def station_from_json(data: dict | str | None):
+def station_from_dict(data: dict | str | None):
     """
     Creates a Station object from a JSON object.
     :param data: The JSON dict.
@@ -140,10 +200,10 @@ def station_from_json(data: dict | str | None):
         return Station(data, data)
 
     return Station(
-        id=data['id'] if 'id' in data else None,
-        name=data['name'] if 'name' in data else None,
-        location=location_from_json(data['location']) if 'location' in data else None,
-        regions=[region_from_json(r) for r in data['regions']] if 'regions' in data else None
+        id=_intern(data.get('id')),
+        name=_intern(data.get('name')),
+        location=location_from_dict(data.get('location')),
+        regions=[region_from_dict(r) for r in data['regions']] if 'regions' in data else None
     )
 
 
@@ -153,6 +213,8 @@ class Stop:
     A stop is a single small point or structure at which vehicles stop.
     """
 
+    __slots__ = ('type', 'id', 'station', 'name', 'location')
+
     def __init__(self, id: str, station: Station, name: str, location: Location = None):
         self.type = 'stop'
         self.id = id
@@ -170,15 +232,15 @@ class Stop:
         })
 
     def to_json(self):
-        return json.dumps(self.to_dict())
+        return orjson.dumps(self.to_dict()).decode()
 
     @staticmethod
     def from_json(json_str):
-        data = json.loads(json_str)
-        return stop_from_json(data)
+        data = orjson.loads(json_str)
+        return stop_from_dict(data)
 
 
-def stop_from_json(data: dict | str | None):
+def stop_from_dict(data: dict | str | None):
     """
     Creates a Stop object from a JSON object.
     :param data: The JSON dict.
@@ -187,17 +249,24 @@ def stop_from_json(data: dict | str | None):
         return None
 
     if isinstance(data, str):
-        return Station(data, data, location_from_json(data))
+        return Station(data, data, location_from_dict(data))
 
     return Stop(
-        id=data['id'] if 'id' in data else None,
-        station=data['station'] if 'station' in data else None,
-        name=data['name'] if 'name' in data else None,
-        location=location_from_json(data['location']) if 'location' in data else None
+        id=_intern(data.get('id')),
+        station=data.get('station'),
+        name=_intern(data.get('name')),
+        location=location_from_dict(data.get('location'))
     )
 
 
-def place_from_json(data: dict | str | None):
+_place_from_dict_by_type = {
+    'location': location_from_dict,
+    'station': station_from_dict,
+    'stop': stop_from_dict
+}
+
+
+def place_from_dict(data: dict | str | None):
     if data is None:
         return None
 
@@ -205,15 +274,10 @@ def place_from_json(data: dict | str | None):
         return Station(id=data, name=data)
 
     if 'type' not in data:
-        return station_from_json(data)
+        return station_from_dict(data)
 
-    typ = data['type']
-    if typ == 'location':
-        return location_from_json(data)
-    elif typ == 'station':
-        return station_from_json(data)
-    elif typ == 'stop':
-        return stop_from_json(data)
+    parse = _place_from_dict_by_type.get(data['type'])
+    return parse(data) if parse else None
 
 
 class Region:
@@ -222,6 +286,8 @@ class Region:
     A region is a group of stations, like a metropolitan area.
     """
 
+    __slots__ = ('type', 'id', 'name', 'stations')
+
     def __init__(self, id: str, name: str, stations: list[Station] = None):
         self.type = 'region'
         self.id = id
@@ -233,19 +299,19 @@ class Region:
             'type': self.type,
             'id': self.id,
             'name': self.name,
-            'stations': [s.to_dict() for s in self.stations] if self.stations else None
+            'stations': list(map(Station.to_dict, self.stations)) if self.stations else None
         })
 
     def to_json(self):
-        return json.dumps(self.to_dict())
+        return orjson.dumps(self.to_dict()).decode()
 
     @staticmethod
     def from_json(json_str):
-        data = json.loads(json_str)
-        return region_from_json(data)
+        data = orjson.loads(json_str)
+        return region_from_dict(data)
 
 
-def region_from_json(data: dict | str | None):
+def region_from_dict(data: dict | str | None):
     """
     Creates a Region object from a JSON object.
     :param data: The JSON dict.
@@ -257,9 +323,9 @@ def region_from_json(data: dict | str | None):
         return Region(data, data)
 
     return Region(
-        id=data['id'] if 'id' in data else None,
-        name=data['name'] if 'name' in data else None,
-        stations=[station_from_json(s) for s in data['stations']] if 'stations' in data else None
+        id=data.get('id'),
+        name=data.get('name'),
+        stations=[station_from_dict(s) for s in data['stations']] if 'stations' in data else None
     )
 
 
@@ -292,29 +358,14 @@ class Mode(Enum):
         return self.mode
 
     def to_json(self):
-        return json.dumps(self.mode)
+        return orjson.dumps(self.mode).decode()
 
     @staticmethod
     def from_string(mode):
-        if mode == 'train':
-            return Mode.TRAIN
-        elif mode == 'bus':
-            return Mode.BUS
-        elif mode == 'watercraft':
-            return Mode.WATERCRAFT
-        elif mode == 'taxi':
-            return Mode.TAXI
-        elif mode == 'gondola':
-            return Mode.GONDOLA
-        elif mode == 'aircraft':
-            return Mode.AIRCRAFT
-        elif mode == 'car':
-            return Mode.CAR
-        elif mode == 'bicycle':
-            return Mode.BICYCLE
-        elif mode == 'walking':
-            return Mode.WALKING
-        return Mode.UNKNOWN
+        return _modes_by_string.get(mode, Mode.UNKNOWN)
+
+
+_modes_by_string = {m.mode: m for m in Mode}
 
 
 class Operator:
@@ -323,6 +374,8 @@ class Operator:
     An operator is an agency or company that runs public transport services.
     """
 
+    __slots__ = ('type', 'id', 'name')
+
     def __init__(self, id: str, name: str):
         self.type = 'operator'
         self.id = id
@@ -336,15 +389,15 @@ class Operator:
         })
 
     def to_json(self):
-        return json.dumps(self.to_dict())
+        return orjson.dumps(self.to_dict()).decode()
 
     @staticmethod
     def from_json(json_str):
-        data = json.loads(json_str)
-        return operator_from_json(data)
+        data = orjson.loads(json_str)
+        return operator_from_dict(data)
 
 
-def operator_from_json(data: dict | str | None):
+def operator_from_dict(data: dict | str | None):
     """
     Creates an Operator object from a JSON object.
     :param data: The JSON dict.
@@ -356,8 +409,8 @@ def operator_from_json(data: dict | str | None):
         return Operator(data, data)
 
     return Operator(
-        id=data['id'] if 'id' in data else None,
-        name=data['name'] if 'name' in data else None
+        id=_intern(data.get('id')),
+        name=_intern(data.get('name'))
     )
 
 
@@ -367,6 +420,8 @@ class Line:
     A line is a set of routes operated by a public transport agency.
     """
 
+    __slots__ = ('type', 'id', 'name', 'mode', 'sub_mode', 'routes', 'operator')
+
     def __init__(self, id: str, name: str, mode: Mode, routes: list, operator: Operator = None, sub_mode: str = None):
         self.type = 'line'
         self.id = id
@@ -381,22 +436,22 @@ class Line:
             'type': self.type,
             'id': self.id,
             'name': self.name,
-            'mode': self.mode.to_string(),
+            'mode': self.mode.mode,
             'subMode': self.sub_mode,
-            'routes': [r.to_dict() for r in self.routes] if self.routes else None,
+            'routes': list(map(Route.to_dict, self.routes)) if self.routes else None,
             'operator': self.operator.to_dict() if self.operator else None
         })
 
     def to_json(self):
-        return json.dumps(self.to_dict())
+        return orjson.dumps(self.to_dict()).decode()
 
     @staticmethod
     def from_json(json_str):
-        data = json.loads(json_str)
-        return line_from_json(data)
+        data = orjson.loads(json_str)
+        return line_from_dict(data)
 
 
-def line_from_json(data: dict | str | None):
+def line_from_dict(data: dict | str | None):
     """
     Creates a Line object from a JSON object.
     :param data: The JSON dict.
@@ -408,12 +463,12 @@ def line_from_json(data: dict | str | None):
         return Line(data, data, Mode.UNKNOWN, [], None)
 
     return Line(
-        id=data['id'] if 'id' in data else None,
-        name=data['name'] if 'name' in data else None,
+        id=_intern(data.get('id')),
+        name=_intern(data.get('name')),
         mode=Mode.from_string(data['mode']) if 'mode' in data else None,
-        sub_mode=data['subMode'] if 'subMode' in data else None,
-        routes=[route_from_json(r) for r in data['routes']] if 'routes' in data else None,
-        operator=operator_from_json(data['operator']) if 'operator' in data else None
+        sub_mode=_intern(data.get('subMode')),
+        routes=[route_from_dict(r) for r in data['routes']] if 'routes' in data else None,
+        operator=operator_from_dict(data.get('operator'))
     )
 
 
@@ -423,6 +478,8 @@ class Route:
     A route is a set of stations served by a line.
     """
 
+    __slots__ = ('type', 'id', 'line', 'mode', 'sub_mode', 'stops')
+
     def __init__(self, id: str, line: Line, mode: Mode, stops: list[Station | Stop | Location], sub_mode: str = None):
         self.type = 'route'
         self.id = id
@@ -436,16 +493,16 @@ class Route:
             'type': self.type,
             'id': self.id,
             'line': self.line.to_dict() if self.line else None,
-            'mode': self.mode.to_string(),
+            'mode': self.mode.mode,
             'subMode': self.sub_mode,
             'stops': [s.to_dict() for s in self.stops] if self.stops else None
         })
 
     def to_json(self):
-        return json.dumps(self.to_dict())
+        return orjson.dumps(self.to_dict()).decode()
 
 
-def route_from_json(data: dict | str | None):
+def route_from_dict(data: dict | str | None):
     """
     Creates a Route object from a JSON object.
     :param data: The JSON dict.
@@ -454,25 +511,24 @@ def route_from_json(data: dict | str | None):
         return None
 
     if isinstance(data, str):
-        return Route(data, line_from_json(data), Mode.UNKNOWN, [])
+        return Route(data, line_from_dict(data), Mode.UNKNOWN, [])
 
     return Route(
-        id=data['id'] if 'id' in data else None,
-        line=line_from_json(data['line']) if 'line' in data else None,
+        id=data.get('id'),
+        line=line_from_dict(data.get('line')),
         mode=Mode.from_string(data['mode']) if 'mode' in data else None,
-        sub_mode=data['subMode'] if 'subMode' in data else None,
-        stops=[place_from_json(s) for s in data['stops']] if 'stops' in data else None
+        sub_mode=data.get('subMode'),
+        stops=[place_from_dict(s) for s in data['stops']] if 'stops' in data else None
     )
 
 
-class ScheduleSequenceElement:
+class ScheduleSequenceElement(NamedTuple):
     """
     Represents an element in a schedule sequence.
     """
 
-    def __init__(self, arrival: int = None, departure: int = None):
-        self.arrival = arrival
-        self.departure = departure
+    arrival: int = None
+    departure: int = None
 
     def to_dict(self):
         return _remove_empty_keys({
@@ -481,11 +537,11 @@ class ScheduleSequenceElement:
         })
 
     def to_json(self):
-        return json.dumps(self.to_dict())
+        return orjson.dumps(self.to_dict()).decode()
 
     @staticmethod
     def from_json(json_str):
-        data = json.loads(json_str)
+        data = orjson.loads(json_str)
         return ScheduleSequenceElement(data['arrival'], data['departure'])
 
 
@@ -495,6 +551,8 @@ class Schedule:
     A schedule is a timetable for a route.
     """
 
+    __slots__ = ('type', 'id', 'route', 'mode', 'sub_mode', 'arrivals', 'departures', 'starts')
+
     def __init__(self, id: str, route: Route, mode: Mode, sequence: list[ScheduleSequenceElement], starts,
                  sub_mode=None):
         self.type = 'schedule'
@@ -502,30 +560,38 @@ class Schedule:
         self.route = route
         self.mode = mode
         self.sub_mode = sub_mode
-        self.sequence = sequence
+        # the sequence is stored as parallel arrays of relative times, missing times are NaN
+        sequence = sequence or []
+        self.arrivals = _schedule_times([s.arrival for s in sequence])
+        self.departures = _schedule_times([s.departure for s in sequence])
         self.starts = starts
 
+    @property
+    def sequence(self) -> list[ScheduleSequenceElement]:
+        return [ScheduleSequenceElement(_schedule_time(a), _schedule_time(d))
+                for (a, d) in zip(self.arrivals.tolist(), self.departures.tolist())]
+
     def to_dict(self):
         return _remove_empty_keys({
             'type': self.type,
             'id': self.id,
             'route': self.route.to_dict() if self.route else None,
-            'mode': self.mode.to_string(),
+            'mode': self.mode.mode,
             'subMode': self.sub_mode,
-            'sequence': [s.to_dict() for s in self.sequence] if self.sequence else None,
+            'sequence': list(map(ScheduleSequenceElement.to_dict, self.sequence)) if len(self.arrivals) > 0 else None,
             'starts': self.starts
         })
 
     def to_json(self):
-        return json.dumps(self.to_dict())
+        return orjson.dumps(self.to_dict()).decode()
 
     @staticmethod
     def from_json(json_str):
-        data = json.loads(json_str)
-        return schedule_from_json(data)
+        data = orjson.loads(json_str)
+        return schedule_from_dict(data)
 
 
-def schedule_from_json(data: dict | str | None):
+def schedule_from_dict(data: dict | str | None):
     """
     Creates a Schedule object from a JSON object.
     :param data: The JSON dict.
@@ -533,17 +599,37 @@ def schedule_from_json(data: dict | str | None):
     if data is None:
         return None
     if isinstance(data, str):
-        return Schedule(data, route_from_json(data), Mode.UNKNOWN, [], None)
-    return Schedule(
-        id=data['id'] if 'id' in data else None,
-        route=route_from_json(data['route']) if 'route' in data else None,
+        return Schedule(data, route_from_dict(data), Mode.UNKNOWN, [], None)
+
+    schedule = Schedule(
+        id=data.get('id'),
+        route=route_from_dict(data.get('route')),
         mode=Mode.from_string(data['mode']) if 'mode' in data else None,
-        sub_mode=data['subMode'] if 'subMode' in data else None,
-        sequence=[ScheduleSequenceElement(s['arrival'], s['departure']) for s in
-                  data['sequence']] if 'sequence' in data else None,
-        starts=data['starts'] if 'starts' in data else None
+        sub_mode=data.get('subMode'),
+        sequence=None,
+        starts=data.get('starts')
     )
 
+    sequence = data.get('sequence') or []
+    schedule.arrivals = _schedule_times([s.get('arrival') for s in sequence])
+    schedule.departures = _schedule_times([s.get('departure') for s in sequence])
+
+    return schedule
+
+
+def _schedule_times(times: list[int | None]) -> np.ndarray:
+    """
+    Convert the times of a schedule sequence to an array, missing times become NaN
+    """
+    return np.fromiter((np.nan if t is None else t for t in times), dtype=np.float64, count=len(times))
+
+
+def _schedule_time(t: float) -> int | None:
+    """
+    Convert a time of a schedule array back to a sequence time (see _schedule_times)
+    """
+    return None if math.isnan(t) else int(t)
+
 
 class Stopover:
     """
@@ -551,6 +637,9 @@ class Stopover:
     A stopover is when a vehicle stops at a station or stop.
     """
 
+    __slots__ = ('type', 'stop', 'arrival', 'arrival_delay', 'arrival_platform', 'departure', 'departure_delay',
+                 'departure_platform')
+
     def __init__(self, stop: Stop | Station | Location, arrival: datetime.datetime = None, arrival_delay: int = None,
                  arrival_platform: str = None,
                  departure: datetime.datetime = None, departure_delay: int = None, departure_platform: str = None):
@@ -575,16 +664,29 @@ class Stopover:
             'departurePlatform': self.departure_platform
         })
 
+    def _to_json_dict(self):
+        """ Like to_dict, but the nested objects are left to orjson (see _json_default) """
+        return _remove_empty_keys({
+            'type': self.type,
+            'stop': self.stop,
+            'arrival': format_datetime(self.arrival) if self.arrival else None,
+            'arrivalDelay': self.arrival_delay,
+            'arrivalPlatform': self.arrival_platform,
+            'departure': format_datetime(self.departure) if self.departure else None,
+            'departureDelay': self.departure_delay,
+            'departurePlatform': self.departure_platform
+        })
+
     def to_json(self):
-        return json.dumps(self.to_dict())
+        return orjson.dumps(self, default=_json_default).decode()
 
     @staticmethod
     def from_json(json_str):
-        data = json.loads(json_str)
-        return stopover_from_json(data)
+        data = orjson.loads(json_str)
+        return stopover_from_dict(data)
 
 
-def stopover_from_json(data: dict | str | None):
+def stopover_from_dict(data: dict | str | None):
     """
     Creates a Stopover object from a JSON object.
     :param data: The JSON dict.
@@ -596,37 +698,43 @@ def stopover_from_json(data: dict | str | None):
         return Stopover(stop=Station(data, data))
 
     return Stopover(
-        stop=stop_from_json(data['stop']) if 'stop' in data else None,
-        arrival=read_datetime(data['arrival']) if 'arrival' in data else None,
-        arrival_delay=data['arrivalDelay'] if 'arrivalDelay' in data else None,
-        arrival_platform=data['arrivalPlatform'] if 'arrivalPlatform' in data else None,
-        departure=read_datetime(data['departure']) if 'departure' in data else None,
-        departure_delay=data['departureDelay'] if 'departureDelay' in data else None,
-        departure_platform=data['departurePlatform'] if 'departurePlatform' in data else None
+        stop=stop_from_dict(data.get('stop')),
+        arrival=read_datetime(data.get('arrival')),
+        arrival_delay=data.get('arrivalDelay'),
+        arrival_platform=_intern(data.get('arrivalPlatform')),
+        departure=read_datetime(data.get('departure')),
+        departure_delay=data.get('departureDelay'),
+        departure_platform=_intern(data.get('departurePlatform'))
     )
 
 
+def _get_stop_location(stop: Stop) -> Location | None:
+    if stop.location:
+        return stop.location
+    elif stop.station:
+        return stop.station.location
+    return None
+
+
+_location_getters = {
+    Location: lambda place: place,
+    Station: lambda place: place.location,
+    Stop: _get_stop_location,
+    Stopover: lambda place: get_location(place.stop)
+}
+
+
 def get_location(place: Location | Station | Stop | Stopover) -> Location | None:
     """
     Returns the location of a place.
     :param place: The place.
     :return: The location.
     """
-    if isinstance(place, Location):
-        return place
-    elif isinstance(place, Station):
-        return place.location
-    elif isinstance(place, Stop):
-        if place.location:
-            return place.location
-        elif place.station:
-            return place.station.location
-    elif isinstance(place, Stopover):
-        return get_location(place.stop)
-    return None
+    getter = _location_getters.get(type(place))
+    return getter(place) if getter else None
 
 
-class Price:
+class Price(NamedTuple):
     """
     Represents a price in the public transport system.
     A price is the cost of a journey or leg.
@@ -636,9 +744,8 @@ class Price:
         currency (str): The currency code.
     """
 
-    def __init__(self, amount: float, currency: str):
-        self.amount = amount
-        self.currency = currency
+    amount: float
+    currency: str
 
     def to_dict(self):
         return _remove_empty_keys({
@@ -647,15 +754,15 @@ class Price:
         })
 
     def to_json(self):
-        return json.dumps(self.to_dict())
+        return orjson.dumps(self.to_dict()).decode()
 
     @staticmethod
     def from_json(json_str):
-        data = json.loads(json_str)
-        return price_from_json(data)
+        data = orjson.loads(json_str)
+        return price_from_dict(data)
 
 
-def price_from_json(data: dict | str | None):
+def price_from_dict(data: dict | str | None):
     """
     Creates a Price object from a JSON object.
     :param data: The JSON dict.
@@ -664,8 +771,8 @@ def price_from_json(data: dict | str | None):
         return None
 
     return Price(
-        amount=data['amount'] if 'amount' in data else None,
-        currency=data['currency'] if 'currency' in data else None
+        amount=data.get('amount'),
+        currency=_intern(data.get('currency'))
     )
 
 
@@ -692,6 +799,10 @@ class Leg:
         price (dict): Optional pricing information for the leg.
     """
 
+    __slots__ = ('type', 'origin', 'destination', 'departure', 'arrival', 'mode', 'sub_mode', 'departure_delay',
+                 'departure_platform', 'arrival_delay', 'arrival_platform', 'line', 'direction', 'stopovers',
+                 'schedule', 'public', 'operator', 'price', 'polyline')
+
     def __init__(self, origin: Stop | Station | Location, destination: Stop | Station | Location,
                  departure: datetime.datetime, arrival: datetime.datetime, mode: Mode, sub_mode: str = None,
                  departure_delay: int = None,
@@ -727,7 +838,7 @@ class Leg:
             'destination': self.destination.to_dict() if self.destination else None,
             'departure': format_datetime(self.departure) if self.departure else None,
             'arrival': format_datetime(self.arrival) if self.arrival else None,
-            'mode': self.mode.to_string(),
+            'mode': self.mode.mode,
             'subMode': self.sub_mode,
             'departureDelay': self.departure_delay,
             'departurePlatform': self.departure_platform,
@@ -735,7 +846,7 @@ class Leg:
             'arrivalPlatform': self.arrival_platform,
             'line': self.line.to_dict() if self.line else None,
             'direction': self.direction,
-            'stopovers': [s.to_dict() for s in self.stopovers] if self.stopovers else None,
+            'stopovers': list(map(Stopover.to_dict, self.stopovers)) if self.stopovers else None,
             'schedule': self.schedule.to_dict() if self.schedule else None,
             'public': self.public,
             'operator': self.operator.to_dict() if self.operator else None,
@@ -743,13 +854,37 @@ class Leg:
             'polyline': self.polyline if self.polyline else None
         })
 
+    def _to_json_dict(self):
+        """ Like to_dict, but the nested objects are left to orjson (see _json_default) """
+        return _remove_empty_keys({
+            'type': self.type,
+            'origin': self.origin,
+            'destination': self.destination,
+            'departure': format_datetime(self.departure) if self.departure else None,
+            'arrival': format_datetime(self.arrival) if self.arrival else None,
+            'mode': self.mode.mode,
+            'subMode': self.sub_mode,
+            'departureDelay': self.departure_delay,
+            'departurePlatform': self.departure_platform,
+            'arrivalDelay': self.arrival_delay,
+            'arrivalPlatform': self.arrival_platform,
+            'line': self.line,
+            'direction': self.direction,
+            'stopovers': self.stopovers if self.stopovers else None,
+            'schedule': self.schedule,
+            'public': self.public,
+            'operator': self.operator,
+            'price': self.price,
+            'polyline': self.polyline if self.polyline else None
+        })
+
     def to_json(self):
-        return json.dumps(self.to_dict())
+        return orjson.dumps(self, default=_json_default).decode()
 
     @staticmethod
     def from_json(json_str):
-        data = json.loads(json_str)
-        return leg_from_json(data)
+        data = orjson.loads(json_str)
+        return leg_from_dict(data)
 
     def get_departure(self, realtime=True):
         if not self.departure:
@@ -773,7 +908,7 @@ class Leg:
         return (arr - dep).total_seconds()
 
 
-def leg_from_json(data: dict | str | None):
+def leg_from_dict(data: dict | str | None):
     """
     Creates a Leg object from a JSON object.
     :param data: The JSON dict.
@@ -782,33 +917,117 @@ def leg_from_json(data: dict | str | None):
         return None
 
     return Leg(
-        origin=place_from_json(data['origin']) if 'origin' in data else None,
-        destination=place_from_json(data['destination']) if 'destination' in data else None,
-        departure=read_datetime(data['departure']) if 'departure' in data else None,
-        arrival=read_datetime(data['arrival']) if 'arrival' in data else None,
+        origin=place_from_dict(data.get('origin')),
+        destination=place_from_dict(data.get('destination')),
+        departure=read_datetime(data.get('departure')),
+        arrival=read_datetime(data.get('arrival')),
         mode=Mode.from_string(data['mode']) if 'mode' in data else None,
-        sub_mode=data['subMode'] if 'subMode' in data else None,
-        departure_delay=data['departureDelay'] if 'departureDelay' in data else None,
-        departure_platform=data['departurePlatform'] if 'departurePlatform' in data else None,
-        arrival_delay=data['arrivalDelay'] if 'arrivalDelay' in data else None,
-        arrival_platform=data['arrivalPlatform'] if 'arrivalPlatform' in data else None,
-        line=line_from_json(data['line']) if 'line' in data else None,
-        direction=data['direction'] if 'direction' in data else None,
-        stopovers=[stopover_from_json(s) for s in data['stopovers']] if 'stopovers' in data else None,
-        schedule=schedule_from_json(data['schedule']) if 'schedule' in data else None,
-        public=data['public'] if 'public' in data else None,
-        operator=operator_from_json(data['operator']) if 'operator' in data else None,
-        price=price_from_json(data['price']) if 'price' in data else None,
-        polyline=data['polyline'] if 'polyline' in data else None
+        sub_mode=_intern(data.get('subMode')),
+        departure_delay=data.get('departureDelay'),
+        departure_platform=_intern(data.get('departurePlatform')),
+        arrival_delay=data.get('arrivalDelay'),
+        arrival_platform=_intern(data.get('arrivalPlatform')),
+        line=line_from_dict(data.get('line')),
+        direction=_intern(data.get('direction')),
+        stopovers=[stopover_from_dict(s) for s in data['stopovers']] if 'stopovers' in data else None,
+        schedule=schedule_from_dict(data.get('schedule')),
+        public=data.get('public'),
+        operator=operator_from_dict(data.get('operator')),
+        price=price_from_dict(data.get('price')),
+        polyline=data.get('polyline')
     )
 
 
+_leg_field_parsers = {
+    'type': lambda data: 'leg',
+    'origin': lambda data: place_from_dict(data.get('origin')),
+    'destination': lambda data: place_from_dict(data.get('destination')),
+    'departure': lambda data: read_datetime(data.get('departure')),
+    'arrival': lambda data: read_datetime(data.get('arrival')),
+    'mode': lambda data: Mode.from_string(data['mode']) if 'mode' in data else None,
+    'sub_mode': lambda data: _intern(data.get('subMode')),
+    'departure_delay': lambda data: data.get('departureDelay'),
+    'departure_platform': lambda data: _intern(data.get('departurePlatform')),
+    'arrival_delay': lambda data: data.get('arrivalDelay'),
+    'arrival_platform': lambda data: _intern(data.get('arrivalPlatform')),
+    'line': lambda data: line_from_dict(data.get('line')),
+    'direction': lambda data: _intern(data.get('direction')),
+    'stopovers': lambda data: [stopover_from_dict(s) for s in data['stopovers']] if 'stopovers' in data else [],
+    'schedule': lambda data: schedule_from_dict(data.get('schedule')),
+    'public': lambda data: data.get('public'),
+    'operator': lambda data: operator_from_dict(data.get('operator')),
+    'price': lambda data: price_from_dict(data.get('price')),
+    'polyline': lambda data: data.get('polyline')
+}
+
+
+class LazyLeg(Leg):
+    """
+    A leg that keeps its JSON dict and only parses a field when it is first read (see leg_from_dict_lazy). It behaves
+    like a Leg in every other way, fields can also be assigned as usual.
+    """
+
+    __slots__ = ('_data',)
+
+    def __init__(self, data: dict):
+        self._data = data
+
+    def __getattr__(self, name):
+        # only called for fields that are not set yet
+        parse = _leg_field_parsers.get(name)
+        if parse is None:
+            raise AttributeError(name)
+
+        value = parse(self._data)
+        setattr(self, name, value)
+        return value
+
+    def __reduce__(self):
+        # the default pickling reads every slot, which would parse all fields. only the dict and the fields that were
+        # already parsed (or assigned) are pickled.
+        fields = {}
+        for name in _leg_field_parsers:
+            try:
+                fields[name] = object.__getattribute__(self, name)
+            except AttributeError:
+                pass
+
+        return _lazy_leg_from_state, (self._data, fields)
+
+
+def _lazy_leg_from_state(data: dict, fields: dict):
+    """
+    Restores a pickled LazyLeg (see LazyLeg.__reduce__)
+    :param data: The JSON dict.
+    :param fields: The fields that were already set.
+    """
+    leg = LazyLeg(data)
+    for (name, value) in fields.items():
+        setattr(leg, name, value)
+
+    return leg
+
+
+def leg_from_dict_lazy(data: dict | str | None):
+    """
+    Creates a Leg object from a JSON object, parsing each field on first access. Use this when only a few fields of
+    many legs are read (e.g. the modes of all route options).
+    :param data: The JSON dict.
+    """
+    if data is None:
+        return None
+
+    return LazyLeg(data)
+
+
 class Journey:
     """
     Represents a journey in the public transport system.
     A journey is a set of directions to get from one place to another.
     """
 
+    __slots__ = ('type', 'id', 'legs', 'price')
+
     def __init__(self, id: str, legs: list[Leg], price: Price = None):
         self.type = 'journey'
         self.id = id
@@ -819,17 +1038,26 @@ class Journey:
         return _remove_empty_keys({
             'type': self.type,
             'id': self.id,
-            'legs': [l.to_dict() for l in self.legs] if self.legs else None,
+            'legs': list(map(Leg.to_dict, self.legs)) if self.legs else None,
             'price': self.price.to_dict() if self.price else None
         })
 
+    def _to_json_dict(self):
+        """ Like to_dict, but the nested objects are left to orjson (see _json_default) """
+        return _remove_empty_keys({
+            'type': self.type,
+            'id': self.id,
+            'legs': self.legs if self.legs else None,
+            'price': self.price
+        })
+
     def to_json(self):
-        return json.dumps(self.to_dict())
+        return orjson.dumps(self, default=_json_default).decode()
 
     @staticmethod
     def from_json(json_str):
-        data = json.loads(json_str)
-        return journey_from_json(data)
+        data = orjson.loads(json_str)
+        return journey_from_dict(data)
 
     def get_departure(self, realtime=True):
         if not self.legs:
@@ -883,10 +1111,11 @@ class Journey:
         return line
 
 
-def journey_from_json(data: dict | str | None):
+def journey_from_dict(data: dict | str | None, lazy=False):
     """
     Creates a Journey object from a JSON object.
     :param data: The JSON dict.
+    :param lazy: Whether to parse the fields of the legs on first access (see leg_from_dict_lazy).
     """
     if data is None:
         return None
@@ -894,14 +1123,32 @@ def journey_from_json(data: dict | str | None):
     if isinstance(data, str):
         return Journey(data, [])
 
+    parse_leg = leg_from_dict_lazy if lazy else leg_from_dict
+
     return Journey(
-        id=data['id'] if 'id' in data else None,
-        legs=[leg_from_json(l) for l in data['legs']] if 'legs' in data else None,
-        price=price_from_json(data['price']) if 'price' in data else None
+        id=data.get('id'),
+        legs=[parse_leg(l) for l in data['legs']] if 'legs' in data else None,
+        price=price_from_dict(data.get('price'))
     )
 
 
-def from_json(data: dict | str | None):
+_from_dict_by_type = {
+    'location': location_from_dict,
+    'station': station_from_dict,
+    'stop': stop_from_dict,
+    'region': region_from_dict,
+    'line': line_from_dict,
+    'route': route_from_dict,
+    'schedule': schedule_from_dict,
+    'operator': operator_from_dict,
+    'stopover': stopover_from_dict,
+    'journey': journey_from_dict,
+    'leg': leg_from_dict,
+    'price': price_from_dict
+}
+
+
+def from_dict(data: dict | str | None):
     """
     Creates an FPTF object from a JSON object, depending on data type.
     :param data: The JSON dict.
@@ -910,36 +1157,11 @@ def from_json(data: dict | str | None):
     if data is None:
         return None
     if isinstance(data, list):
-        return [from_json(d) for d in data]
+        return [from_dict(d) for d in data]
     elif isinstance(data, str):
         return data
     elif not isinstance(data, dict):
         return None
 
-    typ = data['type']
-
-    if typ == 'location':
-        return location_from_json(data)
-    elif typ == 'station':
-        return station_from_json(data)
-    elif typ == 'stop':
-        return stop_from_json(data)
-    elif typ == 'region':
-        return region_from_json(data)
-    elif typ == 'line':
-        return line_from_json(data)
-    elif typ == 'route':
-        return route_from_json(data)
-    elif typ == 'schedule':
-        return schedule_from_json(data)
-    elif typ == 'operator':
-        return operator_from_json(data)
-    elif typ == 'stopover':
-        return stopover_from_json(data)
-    elif typ == 'journey':
-        return journey_from_json(data)
-    elif typ == 'leg':
-        return leg_from_json(data)
-    elif typ == 'price':
-        return price_from_json(data)
-    return None
+    parse = _from_dict_by_type.get(data['type'])
+    return parse(data) if parse else None
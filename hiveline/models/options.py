@@ -1,12 +1,15 @@
 import datetime
 
 from hiveline.models import fptf
+from hiveline.models.trace import Trace
 
 
 class Option:
+    __slots__ = ("id", "origin", "destination", "departure", "modes", "journey", "trace")
+
     def __init__(self, id: str, origin: fptf.Location, destination: fptf.Location, departure: datetime.datetime,
                  modes: list[fptf.Mode], journey: fptf.Journey,
-                 trace: list[tuple[tuple[float, float], datetime.datetime, fptf.Mode, bool]] | None = None):
+                 trace: Trace | None = None):
         self.id = id
         self.origin = origin
         self.destination = destination
@@ -32,7 +35,8 @@ class Option:
         destination = fptf.Location(longitude=result["destination"][0], latitude=result["destination"][1])
         departure = fptf.read_datetime(result["departure"])
         modes = [fptf.Mode.from_string(m) for m in result["modes"]]
-        journey = fptf.journey_from_json(result["journey"])
+        # the stats only read a few fields of each leg, so the legs are parsed on demand
+        journey = fptf.journey_from_dict(result["journey"], lazy=True)
         trace = None
         return Option(id, origin, destination, departure, modes, journey, trace)
 
@@ -50,13 +54,19 @@ class Option:
 
         return False
 
-    def get_trace(self) -> list[tuple[tuple[float, float], datetime.datetime, fptf.Mode, bool]]:
+    def get_trace(self) -> Trace:
+        """
+        Get the trace of the journey. The trace is built on the first call and kept on the option.
+        :return: the trace
+        """
         if self.trace is None:
-            self.trace = self.journey.get_trace()
+            self.trace = Trace.from_journey(self.journey)
         return self.trace
 
 
 class Vehicles:
+    __slots__ = ("car", "moto", "utilities", "usage")
+
     def __init__(self, result):
         self.car = result["car"]
         self.moto = result["moto"]
@@ -73,6 +83,8 @@ class Vehicles:
 
 
 class Traveller:
+    __slots__ = ("employed", "employment_type", "vehicles", "age", "vc_created")
+
     def __init__(self, result):
         self.employed = result["employed"]
         self.employment_type = result["employment_type"] if "employment_type" in result else None
@@ -91,13 +103,26 @@ class Traveller:
 
 
 class Options:
+    __slots__ = ("vc_id", "sim_id", "created", "meta", "traveller", "_raw_options", "_options")
+
     def __init__(self, result):
         self.vc_id = result["vc-id"]
         self.sim_id = result["sim-id"]
         self.created = fptf.read_datetime(result["created"])
         self.meta = result["meta"]
         self.traveller = Traveller(result["traveller"])
-        self.options = [Option.from_dict(o) for o in result["options"]]
+        self._raw_options = result["options"]
+        self._options = None
+
+    @property
+    def options(self) -> list[Option]:
+        """
+        The route options. They are parsed on first access, until then the raw dicts are kept.
+        """
+        if self._options is None:
+            self._options = [Option.from_dict(o) for o in self._raw_options]
+            self._raw_options = None
+        return self._options
 
     def get_option(self, option_id: str):
         for o in self.options:
@@ -112,5 +137,5 @@ class Options:
             "created": fptf.format_datetime(self.created),
             "meta": self.meta,
             "traveller": self.traveller.to_dict(),
-            "options": [o.to_dict() for o in self.options]
+            "options": self._raw_options if self._options is None else [o.to_dict() for o in self._options]
         }
@@ -0,0 +1,152 @@
+import datetime
+from typing import Generator
+
+import numpy as np
+import polyline
+
+from hiveline.models import fptf
+
+modes_by_code = list(fptf.Mode)
+mode_codes = {mode: i for (i, mode) in enumerate(modes_by_code)}
+unknown_mode_code = mode_codes[fptf.Mode.UNKNOWN]  # for missing (None) or invalid modes
+
+
+class Trace:
+    """
+    The points of a journey, stored as parallel columns. Coordinates, mode codes (see mode_codes) and leg starts are
+    numpy arrays, the times stay datetime objects (they may be None or carry a timezone).
+    """
+
+    def __init__(self, lon: np.ndarray, lat: np.ndarray, times: list[datetime.datetime | None], modes: np.ndarray,
+                 leg_starts: np.ndarray):
+        """
+        :param lon: the longitudes of the points (float64)
+        :param lat: the latitudes of the points (float64)
+        :param times: the times of the points
+        :param modes: the mode codes of the points (int8)
+        :param leg_starts: whether a point is the first point of a leg (bool)
+        """
+        self.lon = lon
+        self.lat = lat
+        self.times = times
+        self.modes = modes
+        self.leg_starts = leg_starts
+
+    def __len__(self):
+        return len(self.lon)
+
+    @staticmethod
+    def from_tuples(line: list[tuple[tuple[float, float], datetime.datetime, fptf.Mode, bool]]):
+        """
+        Create a trace from a list of (point, time, mode, is leg start) tuples (as returned by fptf.Journey.get_trace)
+        :param line: the trace tuples
+        :return: the trace
+        """
+        n = len(line)
+
+        lon = np.fromiter((point[0] for (point, _, _, _) in line), dtype=np.float64, count=n)
+        lat = np.fromiter((point[1] for (point, _, _, _) in line), dtype=np.float64, count=n)
+        times = [time for (_, time, _, _) in line]
+        modes = np.fromiter((mode_codes.get(mode, unknown_mode_code) for (_, _, mode, _) in line), dtype=np.int8,
+                            count=n)
+        leg_starts = np.fromiter((is_leg_start for (_, _, _, is_leg_start) in line), dtype=bool, count=n)
+
+        return Trace(lon, lat, times, modes, leg_starts)
+
+    @staticmethod
+    def from_journey(journey: fptf.Journey):
+        """
+        Create the trace of a journey. This gives the same points as fptf.Journey.get_trace, but decoded polylines are
+        put into the columns as whole arrays instead of one tuple per point.
+        :param journey: the journey
+        :return: the trace
+        """
+        lon = []
+        lat = []
+        times = []
+        modes = []
+        leg_starts = []
+
+        for leg in journey.legs:
+            mode = mode_codes.get(leg.mode, unknown_mode_code)
+
+            if leg.polyline:
+                points = np.asarray(polyline.decode(leg.polyline, geojson=True), dtype=np.float64).reshape(-1, 2)
+                n = len(points)
+
+                dep = leg.get_departure()
+                dt = (leg.get_arrival() - dep) / (n - 1) if n > 1 else datetime.timedelta(0)
+
+                starts = np.zeros(n, dtype=bool)
+                starts[:1] = True
+
+                lon.append(points[:, 0])
+                lat.append(points[:, 1])
+                times += [dep + i * dt for i in range(n)]
+                modes.append(np.full(n, mode, dtype=np.int8))
+                leg_starts.append(starts)
+                continue
+
+            line = Trace.from_tuples(list(_get_leg_trace(leg)))
+
+            lon.append(line.lon)
+            lat.append(line.lat)
+            times += line.times
+            modes.append(line.modes)
+            leg_starts.append(line.leg_starts)
+
+        if len(lon) == 0:
+            return Trace.from_tuples([])
+
+        return Trace(np.concatenate(lon), np.concatenate(lat), times, np.concatenate(modes),
+                     np.concatenate(leg_starts))
+
+    def select(self, mask: np.ndarray, leg_starts: np.ndarray | None = None):
+        """
+        Create a trace from a subset of the points
+        :param mask: a boolean mask of the points to keep
+        :param leg_starts: (optional) the leg starts of the kept points, defaults to their current leg starts
+        :return: the new trace
+        """
+        if leg_starts is None:
+            leg_starts = self.leg_starts[mask]
+
+        times = [time for (time, keep) in zip(self.times, mask) if keep]
+
+        return Trace(self.lon[mask], self.lat[mask], times, self.modes[mask], leg_starts)
+
+    def iter_tuples(self) -> Generator[tuple[tuple[float, float], datetime.datetime, fptf.Mode, bool], None, None]:
+        """
+        Iterate over the points as (point, time, mode, is leg start) tuples, like fptf.Journey.get_trace returns them
+        """
+        for (lon, lat, time, mode, is_leg_start) in zip(self.lon.tolist(), self.lat.tolist(), self.times,
+                                                        self.modes.tolist(), self.leg_starts.tolist()):
+            yield (lon, lat), time, modes_by_code[mode], is_leg_start
+
+
+def _get_leg_trace(leg: fptf.Leg) -> Generator[tuple[tuple[float, float], datetime.datetime, fptf.Mode, bool], None,
+                                                None]:
+    """
+    Get the trace tuples of a leg without a polyline (like fptf.Journey.get_trace)
+    :param leg: the leg
+    :return: the trace tuples of the leg
+    """
+    if not leg.stopovers:
+        origin_loc = fptf.get_location(leg.origin)
+        dest_loc = fptf.get_location(leg.destination)
+
+        if origin_loc and dest_loc:
+            yield (origin_loc.longitude, origin_loc.latitude), leg.departure, leg.mode, True
+            yield (dest_loc.longitude, dest_loc.latitude), leg.arrival, leg.mode, False
+
+        return
+
+    for i, stopover in enumerate(leg.stopovers):
+        stopover_loc = fptf.get_location(stopover.stop)
+
+        t = stopover.departure
+        if not t:
+            t = stopover.arrival
+
+        if stopover_loc:
+            yield (stopover_loc.longitude, stopover_loc.latitude), t, leg.mode, i == 0
@@ -1,11 +1,17 @@
 import os
+from functools import lru_cache
 
 import dotenv
-import pandas as pd
 from pymongo import MongoClient, UpdateOne
 
 
+@lru_cache(maxsize=1)
 def get_database():
+    """
+    Get the project database. The client is only created once per process, MongoClient keeps a thread-safe
+    connection pool that is shared by all callers.
+    :return: the database
+    """
     dotenv.load_dotenv()
 
     user = os.getenv("UP_MONGO_USER")
@@ -21,6 +27,8 @@ def get_database():
 
 
 def dict_to_df(dictionnary):
+    import pandas as pd  # only the dataframe helpers need pandas, so the routing code does not import it
+
     df = pd.DataFrame(dictionnary.find({}))
     return df
 
@@ -61,6 +69,8 @@ def is_number(string):
     return all(char.isdigit() for char in string)
 
 def transform_from_mongo_extract_year(df):
+    import pandas as pd
+
     # get the year field
     year = [c for c in df.columns if is_number(c)][0]
     # extract everything inside the year field 
@@ -74,6 +84,8 @@ def transform_tiles_from_mongo(df):
     Args:
         df (pd.DataFrame): the df coming directly from mongo, that needs to be transformed
     '''
+    import pandas as pd
+
     df = transform_from_mongo_extract_year(df)
     if 'work' in df.columns:
         prefix = 'work'
@@ -92,6 +104,8 @@ def transform_regions_from_mongo(df):
     '''
     Transform the demographic data from mongodb to convert it back to a dataframe
     '''
+    import pandas as pd
+
     df = transform_from_mongo_extract_year(df)
     prefixes = [c for c in df.columns if c in ['age', 'vehicle', 'employment_rate', 'employment_type']]
     # extract the sub dicts
@@ -112,6 +126,8 @@ def search(db, collection, match_field, match_ids, fields):
     Returns:
         pd.DataFrame
     '''
+    import pandas as pd
+
     if collection == 'tiles':
         match_dict = {
             'nuts-3': 'nuts3',
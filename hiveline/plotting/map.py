@@ -1,4 +1,3 @@
-import datetime
 import os
 import sys
 import time
@@ -8,12 +7,14 @@ import h3
 import matplotlib.cm as cm
 import matplotlib.colors
 import matplotlib.colors as mpl_colors
+import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
-from geojson import LineString
+from geojson import LineString, MultiLineString
 from selenium import webdriver
 
 from hiveline.models import fptf
+from hiveline.models.trace import Trace, modes_by_code
 
 load_dotenv()
 PROJECT_PATH = os.getenv("PROJECT_PATH")
@@ -44,26 +45,20 @@ def _hexagon_to_polygon(hexagon):
     return [[coord[1], coord[0]] for coord in boundary]  # Switch to (lat, long)
 
 
-def _extract_mode_traces(trace: list[tuple[tuple[float, float], datetime.datetime, fptf.Mode, bool]]) -> list[
-    tuple[LineString, fptf.Mode]]:
-    last_mode = trace[0][2]
-    line = []
-    traces = []
+def _extract_mode_traces(trace: Trace) -> list[tuple[LineString, fptf.Mode]]:
+    if len(trace) == 0:
+        return []
 
-    for point, _, mode, _ in trace:
-        if mode != last_mode:
-            traces.append((LineString(line), last_mode))
-            line = []
-        line.append(point)
-        last_mode = mode
+    points = np.column_stack((trace.lon, trace.lat)).tolist()
 
-    if line:
-        traces.append((LineString(line), last_mode))
-    return traces
+    # a new line starts at each point where the mode changes
+    starts = [0] + (np.flatnonzero(trace.modes[1:] != trace.modes[:-1]) + 1).tolist()
+    ends = starts[1:] + [len(trace)]
 
+    return [(LineString(points[start:end]), modes_by_code[trace.modes[start]]) for (start, end) in zip(starts, ends)]
 
-def get_line_traces_by_mode(traces: list[list[tuple[tuple[float, float], datetime.datetime, fptf.Mode, bool]]]) -> dict[
-    fptf.Mode, list[LineString]]:
+
+def get_line_traces_by_mode(traces: list[Trace]) -> dict[fptf.Mode, list[LineString]]:
     mode_trace_lists = [_extract_mode_traces(trace) for trace in traces]
     mode_traces = [item for sublist in mode_trace_lists for item in sublist]
 
@@ -203,15 +198,22 @@ class CityPlotter():
 
         for mode in draw_order:
             color = color_map[mode]
+            lines = traces.get(mode, [])
+
+            if len(lines) == 0:
+                continue
+
+            # all lines of a mode share one style, so they are added as a single layer instead of one layer per line
+            tgeojson = folium.GeoJson(MultiLineString([line["coordinates"] for line in lines]),
+                                      name='tgeojson',
+                                      style_function=self.get_style_function(color, weight, opacity, dash_array)
+                                      )
+            tgeojson.add_to(self.map)
 
-            for line in traces.get(mode, []):
-                tgeojson = folium.GeoJson(line,
-                                          name='tgeojson',
-                                          style_function=self.get_style_function(color, weight, opacity, dash_array)
-                                          )
-                tgeojson.add_to(self.map)
+    def export_to_png(self, folder='images/', filename='image', tall_city=False, webdriver=None, folium_map=None):
+        if folium_map is None:
+            folium_map = self.map
 
-    def export_to_png(self, folder='images/', filename='image', tall_city=False, webdriver=None):
         if webdriver is None:
             webdriver = self.setup_webdriver()
 
@@ -222,7 +224,7 @@ class CityPlotter():
 
         filepath = PROJECT_PATH + 'visualization/' + folder + filename
         filepath_html = filepath + '.html'
-        self.map.save(filepath_html)
+        folium_map.save(filepath_html)
         # image resolution
         ratio = 1920 / 1080
         height = 1200 if tall_city else 1080
@@ -1,4 +1,5 @@
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 import seaborn as sns
 
@@ -13,6 +14,123 @@ class CongestionOptions:
     max_motorcycle_slowdown = 0.7
 
 
+def _search_sorted(sorted_values: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """
+    Find the indices of values in a sorted array. All values must be present in the array.
+    :param sorted_values: the sorted array to search in
+    :param values: the values to search for
+    :return: the indices of the values in sorted_values
+    """
+    indices = np.searchsorted(sorted_values, values)
+
+    if len(values) > 0 and (indices.max() >= len(sorted_values) or np.any(sorted_values[indices] != values)):
+        raise KeyError("Value not found in sorted array")
+
+    return indices
+
+
+def _pack_edge_keys(node_indices: np.ndarray) -> np.ndarray:
+    """
+    Pack the edges between consecutive nodes of a route into int64 keys. The smaller node index is stored in the upper
+    32 bits, the larger one in the lower 32 bits, so both directions of an edge get the same key.
+    :param node_indices: the (dense) node indices of the route
+    :return: the packed edge keys
+    """
+    a = node_indices[:-1]
+    b = node_indices[1:]
+    return (np.minimum(a, b) << 32) | np.maximum(a, b)
+
+
+class EdgeTable:
+    """
+    Street edges stored as parallel numpy arrays. Edges are identified by packed int64 keys and looked up with
+    np.searchsorted on the sorted key array. OSM node ids don't fit into 32 bits, so the keys are built from the
+    position of the nodes in the sorted node id array instead of the node ids themselves.
+    """
+
+    def __init__(self, node_ids: np.ndarray, keys: np.ndarray):
+        """
+        :param node_ids: the sorted, unique OSM node ids
+        :param keys: the sorted, unique packed edge keys
+        """
+        self.node_ids = node_ids
+        self.keys = keys
+        self.data = [None] * len(keys)  # street-edge-data documents
+        self.lengths = np.zeros(len(keys), dtype=np.float64)
+        self.lanes = np.full(len(keys), 2, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.keys)
+
+    @staticmethod
+    def from_routes(routes):
+        """
+        Create an edge table containing all edges of the given routes
+        :param routes: an iterable of routes (lists of OSM nodes)
+        :return: the edge table
+        """
+        routes = [np.asarray(route, dtype=np.int64) for route in routes]
+
+        if len(routes) == 0:
+            return EdgeTable(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+
+        node_ids = np.unique(np.concatenate(routes))
+        keys = np.unique(np.concatenate([_pack_edge_keys(np.searchsorted(node_ids, route)) for route in routes]))
+
+        return EdgeTable(node_ids, keys)
+
+    def get_end_nodes(self):
+        """
+        Get the OSM node ids of both ends of each edge
+        :return: the origins and destinations (origin < destination), in the same order as the keys
+        """
+        return self.node_ids[self.keys >> 32], self.node_ids[self.keys & 0xFFFFFFFF]
+
+    def lookup(self, osm_nodes) -> np.ndarray:
+        """
+        Get the indices of the edges between consecutive nodes of a route
+        :param osm_nodes: the OSM nodes of the route
+        :return: the edge indices
+        """
+        node_indices = _search_sorted(self.node_ids, np.asarray(osm_nodes, dtype=np.int64))
+        return _search_sorted(self.keys, _pack_edge_keys(node_indices))
+
+
+def _get_osm_nodes(leg) -> np.ndarray:
+    """
+    Get the OSM nodes of a leg as an int64 array. The array replaces the decoded list on the leg, so a leg is only
+    converted once, no matter how often it is read.
+    :param leg: the leg (must have osm_nodes)
+    :return: the OSM nodes
+    """
+    osm_nodes = leg["osm_nodes"]
+
+    if type(osm_nodes) is not np.ndarray:
+        osm_nodes = np.asarray(osm_nodes, dtype=np.int64)
+        leg["osm_nodes"] = osm_nodes
+
+    return osm_nodes
+
+
+_sim_dates = {}  # (database name, sim id) -> sim date
+
+
+def _get_sim_date(db, sim_id):
+    """
+    Get the date of a simulation. Simulations don't change, so the date is only fetched once per simulation.
+    :param db: the database
+    :param sim_id: the simulation id
+    :return: the simulation date string
+    """
+    key = (db.name, sim_id)
+
+    if key not in _sim_dates:
+        sim = db["simulations"].find_one({"sim-id": sim_id})
+        _sim_dates[key] = sim["sim-date"]
+
+    return _sim_dates[key]
+
+
 def find_results_with_osm_nodes(db, sim_id):
     """
     Find all results that have OSM nodes in their legs
@@ -68,9 +186,7 @@ def find_matching_route_options(db, sim_id, journeys):
     :param journeys: the journeys
     :return: the route options (same order as journeys)
     """
-    route_options = db["route-options"]
-
-    route_options = list(route_options.find({"sim-id": sim_id}))
+    route_options = db["route-options"].find({"sim-id": sim_id}, projection={"vc-id": True, "traveller": True})
 
     route_options = {option["vc-id"]: option for option in route_options}
 
@@ -79,7 +195,7 @@ def find_matching_route_options(db, sim_id, journeys):
 
 def get_car_routes(journeys, mask=None):
     """
-    Get all car routes from a set of journeys. Car routes are lists of OSM nodes.
+    Get all car routes from a set of journeys. Car routes are arrays of OSM nodes.
     :param journeys: the journeys
     :param mask: (optional) a mask to filter out journeys
     :return: a list of objects with the following fields:
@@ -109,7 +225,7 @@ def get_car_routes(journeys, mask=None):
 
                 for leg in itinerary["legs"]:
                     if "osm_nodes" in leg:
-                        iti_routes.append(leg["osm_nodes"])
+                        iti_routes.append(_get_osm_nodes(leg))
 
                 if len(iti_routes) == 0:
                     continue
@@ -130,39 +246,98 @@ def get_car_routes(journeys, mask=None):
     return vc_routes
 
 
-def get_usage_set(journeys, mask=None, vehicles_per_journey=1.0):
+def iter_car_routes(journeys):
+    """
+    Iterate over the car routes of a set of journeys. This walks the journeys like get_car_routes, but only yields the
+    routes themselves, without collecting them per virtual commuter.
+    :param journeys: the journeys
+    :return: a generator of car routes (arrays of OSM nodes)
+    """
+    for result in journeys:
+        for option in result["options"]:
+            if option is None:
+                continue
+
+            iti_routes = []
+
+            for itinerary in option["itineraries"]:
+                iti_routes = [_get_osm_nodes(leg) for leg in itinerary["legs"] if "osm_nodes" in leg]
+
+                if len(iti_routes) > 0:
+                    break
+
+            if len(iti_routes) == 0:
+                continue
+
+            yield from iti_routes
+            break
+
+
+def get_base_usage_set(journeys, edges, mask=None):
     """
-    Get the usage set of a set of journeys. The usage set is a dictionary of edges and their usage.
+    Get the usage set of a set of journeys for one vehicle per journey. The usage set for any other number of vehicles
+    per journey is this usage set multiplied by that number, so it only needs to be computed once.
     :param journeys: a list of journeys
+    :param edges: the edge table (from get_edges)
     :param mask: (optional) a mask to filter out journeys
-    :param vehicles_per_journey: the number of vehicles per journey
-    :return: a dictionary of edges and their usage. keys are tuples of OSM nodes, values are floats.
+    :return: an array with the usage of each edge, in the same order as the edge table
     """
     car_routes = get_car_routes(journeys, mask)
 
     total_weight = sum([vc["weight"] for vc in car_routes])
 
-    total_num_vehicles = len(car_routes) * vehicles_per_journey
+    weight_factor = len(car_routes) / total_weight if total_weight > 0 else 0
 
-    weight_factor = total_num_vehicles / total_weight if total_weight > 0 else 0
-
-    usage_set = {}
+    edge_indices = []
+    edge_weights = []
 
     for vc in car_routes:
         routes = vc["routes"]
         weight = vc["weight"]
 
         for route in routes:
-            for (origin, destination) in zip(route[:-1], route[1:]):
-                key = (origin, destination)
-                if origin > destination:
-                    key = (destination, origin)
+            route_edges = edges.lookup(route)
+            edge_indices.append(route_edges)
+            edge_weights.append(np.full(len(route_edges), weight * weight_factor))
+
+    if len(edge_indices) == 0:
+        return np.zeros(len(edges))
+
+    return np.bincount(np.concatenate(edge_indices), weights=np.concatenate(edge_weights), minlength=len(edges))
+
 
-                if key not in usage_set:
-                    usage_set[key] = 0
-                usage_set[key] += weight * weight_factor
+def get_usage_set(journeys, edges, mask=None, vehicles_per_journey=1.0):
+    """
+    Get the usage set of a set of journeys. The usage set contains the usage of each edge.
+    :param journeys: a list of journeys
+    :param edges: the edge table (from get_edges)
+    :param mask: (optional) a mask to filter out journeys
+    :param vehicles_per_journey: the number of vehicles per journey
+    :return: an array with the usage of each edge, in the same order as the edge table
+    """
+    return get_base_usage_set(journeys, edges, mask) * vehicles_per_journey
+
+
+def _parse_lanes(edge) -> int:
+    """
+    Get the number of lanes of an edge. Defaults to 2 if the edge has no (valid) lane count.
+    :param edge: the edge metadata (the "edge" field of street-edge-data)
+    :return: the number of lanes
+    """
+    lanes = edge.get("lanes")
 
-    return usage_set
+    if type(lanes) is list:
+        lanes = lanes[0] if len(lanes) > 0 else None
+
+    try:
+        lanes = int(lanes)
+    except (ValueError, TypeError):
+        return 2
+
+    if lanes == 0:
+        return 2
+
+    return lanes
 
 
 def get_edges(db, sim_id, journeys):
@@ -171,35 +346,31 @@ def get_edges(db, sim_id, journeys):
     :param db: the database
     :param sim_id: the simulation id
     :param journeys: the journeys to consider
-    :return: a dictionary of edges and their metadata. keys are tuples of OSM nodes, values are dictionaries.
+    :return: an edge table containing all edges used by the journeys and their metadata
     """
-    usage_set = get_usage_set(journeys, mask=None, vehicles_per_journey=0)
-
-    sim = db["simulations"].find_one({"sim-id": sim_id})
+    edges = EdgeTable.from_routes(iter_car_routes(journeys))
 
-    sim_date = sim["sim-date"]
+    sim_date = _get_sim_date(db, sim_id)
 
-    edges_to_download = []
+    origins, destinations = edges.get_end_nodes()
+    origins = origins.tolist()
+    destinations = destinations.tolist()
 
-    for (origin, destination), _ in usage_set.items():
-        edges_to_download.append((origin, destination, sim_date))
-
-    # split into chunks of 1000
-    chunks = [edges_to_download[x:x + 1000] for x in range(0, len(edges_to_download), 1000)]
-
-    edges = {}
     edge_coll = db["street-edge-data"]
 
-    for chunk in chunks:
-        edge_ids = [str(origin) + "-" + str(destination) + "-" + date_str for (origin, destination, date_str) in chunk]
-
-        result = list(edge_coll.find({"edge-id": {"$in": edge_ids}}))
+    # download in chunks of 1000
+    for start in range(0, len(edges), 1000):
+        end = min(start + 1000, len(edges))
 
-        edge_id_set = {edge["edge-id"]: edge for edge in result}
+        edge_ids = [str(origins[i]) + "-" + str(destinations[i]) + "-" + sim_date for i in range(start, end)]
 
-        edge_key_set = {(chunk[i][0], chunk[i][1]): edge_id_set[edge_ids[i]] for i in range(len(chunk))}
+        edge_id_set = {edge["edge-id"]: edge for edge in edge_coll.find({"edge-id": {"$in": edge_ids}})}
 
-        edges.update(edge_key_set)
+        for (i, edge_id) in enumerate(edge_ids):
+            edge = edge_id_set[edge_id]
+            edges.data[start + i] = edge
+            edges.lengths[start + i] = edge["edge"]["length"]
+            edges.lanes[start + i] = _parse_lanes(edge["edge"])
 
     return edges
 
@@ -209,20 +380,12 @@ def get_nodes(db, sim_id, edges):
     Get the nodes for the given simulation id.
     :param db: the database
     :param sim_id: the simulation id
-    :param journeys: the journeys to consider
+    :param edges: the edge table (from get_edges)
     :return: a dictionary of nodes and their metadata. keys are OSM node ids, values are dictionaries.
     """
-    sim = db["simulations"].find_one({"sim-id": sim_id})
-
-    sim_date = sim["sim-date"]
-
-    node_set = set()
+    sim_date = _get_sim_date(db, sim_id)
 
-    for (origin, destination) in edges.keys():
-        node_set.add(origin)
-        node_set.add(destination)
-
-    node_list = list(node_set)
+    node_list = edges.node_ids.tolist()
 
     print("Downloading {} nodes".format(len(node_list)))
 
@@ -235,9 +398,7 @@ def get_nodes(db, sim_id, edges):
     for chunk in chunks:
         node_ids = [str(node) + "-" + sim_date for node in chunk]
 
-        result = list(node_coll.find({"node-id": {"$in": node_ids}}))
-
-        node_id_set = {node["node-id"]: node for node in result}
+        node_id_set = {node["node-id"]: node for node in node_coll.find({"node-id": {"$in": node_ids}})}
 
         node_key_set = {chunk[i]: node_id_set[node_ids[i]] for i in range(len(chunk))}
 
@@ -252,52 +413,100 @@ def get_congestion_set(journeys, edges, mask=None, vehicles_per_journey=1.0):
     """
     Get the congestion set for the given simulation id.
     :param journeys: the journeys to consider
-    :param edges: metadata about the edges
+    :param edges: the edge table (from get_edges)
     :param mask: the mask to apply to the journeys. If None, all journeys are considered
     :param vehicles_per_journey: how many vehicles each journey represents
-    :return: a dictionary of edges and their congestion. keys are tuples of OSM nodes, values are floats.
+    :return: an array with the speed factor of each edge, in the same order as the edge table.
     The values are between 0 and 1 and represent the speed factor to apply to the edge.
     """
-    usage_set = get_usage_set(journeys, mask, vehicles_per_journey)
+    usage_set = get_usage_set(journeys, edges, mask, vehicles_per_journey)
+
+    return get_congestion_set_from_usage(usage_set, edges)
+
+
+def get_congestion_set_from_usage(usage_set, edges):
+    """
+    Get the congestion set for a usage set.
+    :param usage_set: the usage set (from get_usage_set)
+    :param edges: the edge table (from get_edges)
+    :return: an array with the speed factor of each edge, in the same order as the edge table.
+    The values are between 0 and 1 and represent the speed factor to apply to the edge.
+    """
+    # edges without usage keep a speed factor of 1
+    road_usage = usage_set / edges.lanes
+
+    return np.minimum(1, 1 / np.maximum(road_usage, 1))
+
+
+def get_car_legs(journeys, route_options, edges):
+    """
+    Get the car legs of a set of journeys with their edges already looked up. Like get_car_routes, only the first
+    itinerary with car legs of each journey is considered.
+    :param journeys: the journeys
+    :param route_options: the corresponding route options (must be in the same order as the journeys)
+    :param edges: the edge table (from get_edges)
+    :return: a list of objects with the following fields:
+        - route-option-id: the route option id
+        - traveller: the traveller of the journey
+        - has-moto: whether the traveller has a motorcycle
+        - legs: a list of (edge indices, edge lengths, planned duration) tuples
+    """
+    car_legs = []
 
-    congestion_set = {}
+    for (result, route_option) in zip(journeys, route_options):
+        for option in result["options"]:
+            if option is None:
+                continue
 
-    for (origin, destination), vehicle_count_per_minute in usage_set.items():
-        if origin > destination:
-            raise ValueError("Origin is greater than destination")
+            itinerary_legs = None
 
-        edge = edges[(origin, destination)]["edge"]
+            for itinerary in option["itineraries"]:
+                legs = [leg for leg in itinerary["legs"] if "osm_nodes" in leg]
 
-        lanes = 2
+                if len(legs) > 0:
+                    itinerary_legs = legs
+                    break
 
-        if "lanes" in edge:
-            lanes_str = edge["lanes"]
+            if itinerary_legs is None:
+                continue
 
-            if type(lanes_str) is list:
-                lanes_str = lanes_str[0]
+            legs = []
 
-            try:
-                lanes = int(lanes_str)
-            except ValueError or TypeError as e:
-                print(e)
-                pass
+            for leg in itinerary_legs:
+                edge_indices = edges.lookup(_get_osm_nodes(leg))
+                legs.append((edge_indices, edges.lengths[edge_indices], leg["endTime"] - leg["startTime"]))
 
-            if lanes == 0:
-                lanes = 2
+            car_legs.append({
+                "route-option-id": option["route-option-id"],
+                "traveller": route_option["traveller"],
+                "has-moto": vc_extract.has_motorcycle(route_option["traveller"]),
+                "legs": legs
+            })
 
-        total_road_capacity = lanes
-        road_usage = vehicle_count_per_minute / total_road_capacity
-        if road_usage == 0:
-            road_usage = 1
+            break
 
-        speed_factor = 1 / road_usage
+    return car_legs
 
-        if speed_factor > 1:
-            speed_factor = 1
 
-        congestion_set[(origin, destination)] = speed_factor
+def _get_delay(speed_factors, lengths, planned_duration, has_moto, options):
+    """
+    Get the delay for a leg from the speed factors and lengths of its edges.
+    :param speed_factors: the speed factors of the edges
+    :param lengths: the lengths of the edges
+    :param planned_duration: the planned duration of the leg
+    :param has_moto: whether the traveller that uses the leg has a motorcycle
+    :param options: congestion options
+    :return: the delay in seconds
+    """
+    # total speed factor is the weighted average of speed factors for each edge (weighted by edge length)
+    total_speed_factor = float(np.average(speed_factors, weights=lengths))
+
+    if has_moto and total_speed_factor > options.max_motorcycle_slowdown:
+        total_speed_factor = options.max_motorcycle_slowdown
 
-    return congestion_set
+    actual_duration = planned_duration / total_speed_factor
+
+    return actual_duration - planned_duration
 
 
 def get_leg_delay(leg, traveller, edges, congestion_set, options=None):
@@ -305,7 +514,7 @@ def get_leg_delay(leg, traveller, edges, congestion_set, options=None):
     Get the delay for a leg.
     :param leg: the leg
     :param traveller: the traveller that uses the leg
-    :param edges: the set of edges
+    :param edges: the edge table (from get_edges)
     :param congestion_set: the congestion set (from get_congestion_set)
     :param options: congestion options
     :return: the delay in seconds
@@ -313,82 +522,44 @@ def get_leg_delay(leg, traveller, edges, congestion_set, options=None):
     if options is None:
         options = CongestionOptions()
 
-    has_moto = vc_extract.has_motorcycle(traveller)
-
-    osm_nodes = leg["osm_nodes"]
-
-    edge_keys = [
-        (osm_nodes[i], osm_nodes[i + 1]) if osm_nodes[i] < osm_nodes[i + 1] else (osm_nodes[i + 1], osm_nodes[i]) for i
-        in range(len(osm_nodes) - 1)]
-
-    for (origin, destination) in edge_keys:
-        if origin > destination:
-            raise ValueError("Origin is greater than destination")
-
-    edges = [edges[key] for key in edge_keys]
-
-    # if a key is not in congestion_set, no active car visited that edge, so speed factor is 1
-    speed_factors = [congestion_set[key] if key in congestion_set else 1 for key in edge_keys]
-
-    # total speed factor is the weighted average of speed factors for each edge (weighted by edge length)
-    total_length = sum([edge["edge"]["length"] for edge in edges])
-    total_speed_factor = sum([speed_factor * edge["edge"]["length"] for (speed_factor, edge) in
-                              zip(speed_factors, edges)]) / total_length
-
-    if has_moto and total_speed_factor > options.max_motorcycle_slowdown:
-        total_speed_factor = options.max_motorcycle_slowdown
+    edge_indices = edges.lookup(_get_osm_nodes(leg))
 
     planned_duration = leg["endTime"] - leg["startTime"]
 
-    actual_duration = planned_duration / total_speed_factor
+    has_moto = vc_extract.has_motorcycle(traveller)
 
-    return actual_duration - planned_duration
+    return _get_delay(congestion_set[edge_indices], edges.lengths[edge_indices], planned_duration, has_moto, options)
 
 
-def get_delay_set_from_congestion(congestion_set, journeys, route_options, edges, options=None):
+def get_delay_set_from_congestion(congestion_set, journeys, route_options, edges, options=None, car_legs=None):
     """
     Get the delay set for the given congestion set.
     :param congestion_set: The congestion set to use
     :param journeys: The journeys to consider
     :param route_options: The corresponding route options (must be in the same order as the journeys)
-    :param edges: Metadata about the edges (street-edge-data)
+    :param edges: The edge table (from get_edges)
     :param options: Congestion options
+    :param car_legs: (optional) The car legs of the journeys (from get_car_legs). Pass them when computing delay sets
+    for multiple congestion sets of the same journeys.
     :return: A dictionary mapping route-option-ids to the delay for that route option
     """
     if options is None:
         options = CongestionOptions()
 
-    congestion_delays = {}
+    if car_legs is None:
+        car_legs = get_car_legs(journeys, route_options, edges)
 
-    for (result, route_option) in zip(journeys, route_options):
-        traveller = route_option["traveller"]
-
-        for option in result["options"]:
-            if option is None:
-                continue
-
-            found_car_route = False
-
-            for (index, itinerary) in enumerate(option["itineraries"]):
-                itinerary_delay = 0
-
-                for leg in itinerary["legs"]:
-                    if "osm_nodes" not in leg:
-                        continue
-                    found_car_route = True
+    congestion_delays = {}
 
-                    leg_delay = get_leg_delay(leg, traveller, edges, congestion_set, options)
-                    itinerary_delay += leg_delay
+    for car_leg in car_legs:
+        has_moto = car_leg["has-moto"]
 
-                if not found_car_route:
-                    continue
+        itinerary_delay = 0
 
-                congestion_key = option["route-option-id"]
-                congestion_delays[congestion_key] = itinerary_delay
+        for (edge_indices, lengths, planned_duration) in car_leg["legs"]:
+            itinerary_delay += _get_delay(congestion_set[edge_indices], lengths, planned_duration, has_moto, options)
 
-                break
-            if found_car_route:
-                break
+        congestion_delays[car_leg["route-option-id"]] = itinerary_delay
 
     return congestion_delays
 
@@ -398,7 +569,7 @@ def get_delay_set(journeys, route_options, edges, mask=None, vehicles_per_journe
     Get the delay set for the given journeys
     :param journeys: The journeys to consider
     :param route_options: The corresponding route options (must be in the same order as the journeys)
-    :param edges: Metadata about the edges (street-edge-data)
+    :param edges: The edge table (from get_edges)
     :param mask: The mask to apply to the journeys. If None, all journeys are considered
     :param vehicles_per_journey: How many vehicles each journey represents
     :param options: Congestion options
@@ -433,8 +604,13 @@ def plot_delays_for_factors(sim_id, vehicle_factors, total_citizens=1000.0):
     route_options = find_matching_route_options(db, sim_id, journeys)
     edges = get_edges(db, sim_id, journeys)
 
+    # routes and edges don't depend on the vehicle factor, so they are only resolved once
+    base_usage_set = get_base_usage_set(journeys, edges)
+    car_legs = get_car_legs(journeys, route_options, edges)
+
     for vehicles_per_journey in vehicle_factors:
-        delay_set = get_delay_set(journeys, route_options, edges, mask=None, vehicles_per_journey=vehicles_per_journey)
+        congestion_set = get_congestion_set_from_usage(base_usage_set * vehicles_per_journey, edges)
+        delay_set = get_delay_set_from_congestion(congestion_set, journeys, route_options, edges, car_legs=car_legs)
         print(f"Congestion set for {vehicles_per_journey} vehicles per journey")
 
         # plot distribution of values in delay_set
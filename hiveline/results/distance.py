@@ -0,0 +1,53 @@
+import math
+
+import numpy as np
+
+_DEG2RAD = math.pi / 180.0
+_EARTH_RADIUS_M = 6371000.0
+
+
+def approx_dist(origin: tuple[float, float], destination: tuple[float, float]) -> float:
+    """
+    Approximate the distance between two points in meters using the Haversine formula.
+
+    :param origin: (lon, lat) of the first point in degrees
+    :param destination: (lon, lat) of the second point in degrees
+    :return: distance in meters
+    """
+
+    # Convert latitude and longitude from degrees to radians
+    lon1 = origin[0] * _DEG2RAD
+    lat1 = origin[1] * _DEG2RAD
+    lon2 = destination[0] * _DEG2RAD
+    lat2 = destination[1] * _DEG2RAD
+
+    # Difference in coordinates
+    d_lon = lon2 - lon1
+    d_lat = lat2 - lat1
+
+    # Haversine formula
+    a = math.sin(d_lat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(d_lon / 2) ** 2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+    return _EARTH_RADIUS_M * c
+
+
+def approx_dists(lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+    """
+    Approximate the distances between consecutive points in meters using the Haversine formula. This is the
+    vectorized version of approx_dist for whole traces.
+
+    :param lon: the longitudes of the points in degrees
+    :param lat: the latitudes of the points in degrees
+    :return: the len(lon) - 1 distances in meters
+    """
+    lon = lon * _DEG2RAD
+    lat = lat * _DEG2RAD
+
+    d_lon = np.diff(lon)
+    d_lat = np.diff(lat)
+
+    a = np.sin(d_lat / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(d_lon / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    return _EARTH_RADIUS_M * c
@@ -1,17 +1,39 @@
-import datetime
-import json
-import math
+import logging
 import os.path
+import time
 from typing import Callable, Generator
 
-from shapely import Polygon, Point
+import numpy as np
+import orjson
+import zstandard
+import shapely
+from shapely import Polygon
 
 from hiveline.models import fptf
 from hiveline.models.options import Options, Option
+from hiveline.models.trace import Trace, modes_by_code
 from hiveline.mongo.db import get_database
+from hiveline.results.distance import approx_dist, approx_dists
 from hiveline.routing.util import ensure_directory
 
-rail_modes = [fptf.Mode.TRAIN, fptf.Mode.GONDOLA, fptf.Mode.WATERCRAFT]
+log = logging.getLogger(__name__)
+
+rail_modes = frozenset({fptf.Mode.TRAIN, fptf.Mode.GONDOLA, fptf.Mode.WATERCRAFT})
+
+# mode -> index of its car / rail / bus / walk bucket in the stats, -1 for modes that are not counted and -2 (the
+# default) for unknown modes
+_mode_buckets = {
+    fptf.Mode.CAR: 0,
+    fptf.Mode.TRAIN: 1,
+    fptf.Mode.GONDOLA: 1,
+    fptf.Mode.WATERCRAFT: 1,
+    fptf.Mode.BUS: 2,
+    fptf.Mode.WALKING: 3,
+    fptf.Mode.BICYCLE: -1,
+}
+
+# mode code -> bucket
+_code_buckets = np.array([_mode_buckets.get(mode, -2) for mode in modes_by_code], dtype=np.int8)
 
 
 class Journeys:
@@ -30,22 +52,38 @@ class Journeys:
 
     def __find_all(self):
         # check if cached
-        if self.use_cache and os.path.isfile(self.cache + "/" + self.sim_id + ".json"):
-            print("Found cached results")
+        if self.use_cache and os.path.isfile(self.__cache_path()):
+            log.info("Found cached results")
             return self.__load_cache()
 
-        t = datetime.datetime.now()
-
-        results = list(self.db["route-results"].find({"sim-id": self.sim_id}))
-
-        print(f"Found {len(results)} results in {datetime.datetime.now() - t}")
-        t = datetime.datetime.now()
+        t = time.perf_counter_ns()
+
+        pipeline = [
+            {
+                "$match": {
+                    "sim-id": self.sim_id
+                }
+            },
+            {
+                "$project": {
+                    "_id": 0,
+                    "vc-id": 1,
+                    "sim-id": 1,
+                    "created": 1,
+                    "meta": 1,
+                    "traveller": 1,
+                    "options": 1
+                }
+            }
+        ]
+
+        results = self.db["route-results"].aggregate(pipeline, allowDiskUse=True, batchSize=1000)
 
         options = [Options(r) for r in results]
 
-        self.__save_cache(options)
+        log.debug("Found and converted %d results in %.3fms", len(options), (time.perf_counter_ns() - t) / 1e6)
 
-        print(f"Converted {len(options)} results in {datetime.datetime.now() - t}")
+        self.__save_cache(options)
 
         return options
 
@@ -58,7 +96,7 @@ class Journeys:
             if sel is not None:
                 yield self.options[i].get_option(sel)
 
-    def iterate_traces(self, selection=None) -> Generator[list[tuple[tuple[float, float], datetime.datetime, fptf.Mode, bool]], None, None]:
+    def iterate_traces(self, selection=None) -> Generator[Trace, None, None]:
         for (i, o) in enumerate(self.options):
             if selection is not None and i >= len(selection):
                 break
@@ -87,13 +125,16 @@ class Journeys:
         decided = [decision(o) for o in options]
         return [o.id if o is not None else None for o in decided]
 
+    def __cache_path(self):
+        return self.cache + "/" + self.sim_id + ".json.zst"
+
     def __load_cache(self):
-        with open(self.cache + "/" + self.sim_id + ".json", "r") as f:
-            return [Options(o) for o in json.load(f)]
+        with open(self.__cache_path(), "rb") as f:
+            return [Options(o) for o in orjson.loads(zstandard.ZstdDecompressor().decompress(f.read()))]
 
     def __save_cache(self, options: list[Options]):
-        with open(self.cache + "/" + self.sim_id + ".json", "w") as f:
-            json.dump([o.to_dict() for o in options], f)
+        with open(self.__cache_path(), "wb") as f:
+            f.write(zstandard.ZstdCompressor().compress(orjson.dumps([o.to_dict() for o in options])))
 
     def prepare_traces(self):
         """
@@ -117,6 +158,19 @@ class JourneyStats:
         self.bus_passengers = 0
         self.walkers = 0
 
+    @staticmethod
+    def from_buckets(meters, passengers):
+        """
+        Create stats from per bucket totals (see _mode_buckets)
+        :param meters: the meters travelled in each bucket (car, rail, bus, walk)
+        :param passengers: the passengers in each bucket (car, rail, bus, walk)
+        :return: the stats
+        """
+        stats = JourneyStats()
+        stats.car_meters, stats.rail_meters, stats.bus_meters, stats.walk_meters = meters
+        stats.car_passengers, stats.rail_passengers, stats.bus_passengers, stats.walkers = passengers
+        return stats
+
     def to_dict(self):
         return {
             "car_meters": self.car_meters,
@@ -175,41 +229,6 @@ class JourneyStats:
         return transit_passenger_meters / total_passenger_meters
 
 
-def __approx_dist(origin: tuple[float, float], destination: tuple[float, float]):
-    """
-    Approximate the distance between two points in meters using the Haversine formula.
-
-    :param origin: object with fields lon, lat
-    :param destination: object with fields lon, lat
-    :return: distance in meters
-    """
-
-    # Convert latitude and longitude from degrees to radians
-    lon1 = math.radians(origin[0])
-    lat1 = math.radians(origin[1])
-    lon2 = math.radians(destination[0])
-    lat2 = math.radians(destination[1])
-
-    # Radius of the Earth in kilometers
-    r = 6371.0
-
-    # Difference in coordinates
-    d_lon = lon2 - lon1
-    d_lat = lat2 - lat1
-
-    # Haversine formula
-    a = math.sin(d_lat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(d_lon / 2) ** 2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-
-    # Distance in kilometers
-    distance_km = r * c
-
-    # Convert to meters
-    distance_meters = distance_km * 1000
-
-    return distance_meters
-
-
 def get_option_stats(option: Option, shape: Polygon | None = None) -> JourneyStats:
     trace = option.get_trace()
 
@@ -219,96 +238,72 @@ def get_option_stats(option: Option, shape: Polygon | None = None) -> JourneySta
     return get_trace_stats(trace)
 
 
-def filter_trace(trace: list[tuple[tuple[float, float], datetime.datetime, fptf.Mode, bool]], polygon: Polygon):
+def filter_trace(trace: Trace, polygon: Polygon) -> Trace:
     """
     Filter a trace to only include points within a polygon
     :param trace: the trace
-    :param polygon: the polygon
+    :param polygon: the polygon (prepared in place if it isn't already)
     :return: the filtered trace
     """
-    contains = [polygon.contains(Point(t[0])) for t in trace]
+    # the polygon is usually shared by all traces, so it is prepared on first use and stays prepared
+    if not shapely.is_prepared(polygon):
+        shapely.prepare(polygon)
 
-    result = []
+    # test all points against the polygon in one call instead of creating a Point for each of them
+    contains = shapely.contains_xy(polygon, trace.lon, trace.lat)
 
-    carry_leg_start = False
+    # a leg start outside the polygon is carried over to the next point inside of it
+    dropped_starts = np.cumsum(trace.leg_starts & ~contains)
+    kept_dropped_starts = dropped_starts[contains]
+    carried = np.diff(kept_dropped_starts, prepend=0) > 0
 
-    for i in range(len(trace)):
-        cont = contains[i]
-        point, time, mode, is_leg_start = trace[i]
+    return trace.select(contains, trace.leg_starts[contains] | carried)
 
-        if cont:
-            is_leg_start |= carry_leg_start
-            carry_leg_start = False
-            result.append((point, time, mode, is_leg_start))
-            continue
 
-        if is_leg_start:
-            carry_leg_start = True
-            continue
-
-    return result
-
-
-def get_trace_stats(trace: list[tuple[tuple[float, float], datetime.datetime, fptf.Mode, bool]]) -> JourneyStats:
+def get_trace_stats(trace: Trace) -> JourneyStats:
     """
     Get the stats for a journey
     :param trace: the trace
     :return: the stats
     """
-    stats = JourneyStats()
-
-    for (i, (from_point, _, from_mode, is_leg_start)) in enumerate(trace[:-1]):
-        to_point, _, to_mode, _ = trace[i + 1]
-
-        if from_mode != to_mode:
-            continue
+    if len(trace) < 2:
+        return JourneyStats()
 
-        dist = __approx_dist(from_point, to_point)
-        pax = 1 if is_leg_start else 0
+    codes = trace.modes
 
-        if from_mode == fptf.Mode.CAR:
-            stats.car_meters += dist
-            stats.car_passengers += pax
-            continue
+    # only segments between two points of the same mode are counted
+    same_mode = codes[:-1] == codes[1:]
+    buckets = _code_buckets[codes[:-1]]
 
-        if from_mode in rail_modes:
-            stats.rail_meters += dist
-            stats.rail_passengers += pax
-            continue
+    for code in np.unique(codes[:-1][same_mode & (buckets == -2)]):
+        log.warning("Unknown mode: %s", modes_by_code[code])
 
-        if from_mode == fptf.Mode.BUS:
-            stats.bus_meters += dist
-            stats.bus_passengers += pax
-            continue
+    counted = same_mode & (buckets >= 0)
+    dists = approx_dists(trace.lon, trace.lat)
 
-        if from_mode == fptf.Mode.BICYCLE:
-            continue
+    meters = np.bincount(buckets[counted], weights=dists[counted], minlength=4)
+    passengers = np.bincount(buckets[counted & trace.leg_starts[:-1]], minlength=4)
 
-        if from_mode == fptf.Mode.WALKING:
-            stats.walk_meters += dist
-            stats.walkers += pax
-            continue
-
-        print(f"Unknown mode: {from_mode}")
-
-    return stats
+    return JourneyStats.from_buckets(meters.tolist(), passengers.tolist())
 
 
 def __approx_dist_fptf(origin: fptf.Location, destination: fptf.Location):
-    return __approx_dist((origin.longitude, origin.latitude), (destination.longitude, destination.latitude))
+    return approx_dist((origin.longitude, origin.latitude), (destination.longitude, destination.latitude))
 
 
 def __get_distance(leg: fptf.Leg) -> float:
     if not leg.stopovers:
         return __approx_dist_fptf(fptf.get_location(leg.origin), fptf.get_location(leg.destination))
 
-    stopover_locations = [fptf.get_location(stopover.stop) for stopover in leg.stopovers]
-    stopover_locations = [loc for loc in stopover_locations if loc is not None]
+    stopover_locations = (fptf.get_location(stopover.stop) for stopover in leg.stopovers)
+    coordinates = [(loc.longitude, loc.latitude) for loc in stopover_locations if loc is not None]
+
+    if len(coordinates) < 2:
+        return 0
 
-    distances = [__approx_dist_fptf(stopover_locations[i], stopover_locations[i + 1]) for i in
-                 range(len(stopover_locations) - 1)]
+    lon, lat = np.array(coordinates, dtype=np.float64).T
 
-    return sum(distances)
+    return float(approx_dists(lon, lat).sum())
 
 
 def get_journey_stats(journey: fptf.Journey) -> JourneyStats:
@@ -317,35 +312,18 @@ def get_journey_stats(journey: fptf.Journey) -> JourneyStats:
     :param journey: the journey
     :return: the stats
     """
-    stats = JourneyStats()
+    meters = [0, 0, 0, 0]
+    passengers = [0, 0, 0, 0]
 
     for leg in journey.legs:
-        mode = leg.mode
-        dist = __get_distance(leg)
-
-        if mode == fptf.Mode.CAR:
-            stats.car_meters += dist
-            stats.car_passengers += 1
-            continue
-
-        if mode in rail_modes:
-            stats.rail_meters += dist
-            stats.rail_passengers += 1
-            continue
-
-        if mode == fptf.Mode.BUS:
-            stats.bus_meters += dist
-            stats.bus_passengers += 1
-            continue
-
-        if mode == fptf.Mode.BICYCLE:
-            continue
+        bucket = _mode_buckets.get(leg.mode, -2)
 
-        if mode == fptf.Mode.WALKING:
-            stats.walk_meters += dist
-            stats.walkers += 1
+        if bucket < 0:
+            if bucket == -2:
+                log.warning("Unknown mode: %s", leg.mode)
             continue
 
-        print(f"Unknown mode: {mode}")
+        meters[bucket] += __get_distance(leg)
+        passengers[bucket] += 1
 
-    return stats
+    return JourneyStats.from_buckets(meters, passengers)
@@ -1,7 +1,12 @@
 import datetime
+import logging
 import random
+import time
 import uuid
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import partial
 
+import numpy as np
 import osmnx
 from matplotlib import pyplot as plt
 
@@ -11,7 +16,11 @@ from hiveline.od.place import Place
 from hiveline.results.journeys import Journeys, Option, Options, get_option_stats, JourneyStats
 from hiveline.routing.util import ensure_directory
 
-rail_modes = [fptf.Mode.TRAIN, fptf.Mode.BUS, fptf.Mode.GONDOLA, fptf.Mode.WATERCRAFT]
+log = logging.getLogger(__name__)
+
+stats_chunksize = 64  # options per task sent to a worker process
+
+rail_modes = frozenset({fptf.Mode.TRAIN, fptf.Mode.BUS, fptf.Mode.GONDOLA, fptf.Mode.WATERCRAFT})
 
 
 class Params:
@@ -57,10 +66,8 @@ def decide(options: Options, params: Params = None) -> Option | None:
     if len(valid_options) == 0:
         return None
 
-    durations = [o.journey.duration() for o in valid_options]
-    durations = [d if d is not None else 0 for d in durations]
-
-    return valid_options[durations.index(min(durations))]  # choose the fastest option
+    # choose the fastest option (unknown durations count as 0)
+    return min(valid_options, key=lambda o: o.journey.duration() or 0)
 
 
 def __option_has_car(option):
@@ -92,13 +99,59 @@ def merge_journey_stats(stats: list[JourneyStats]) -> JourneyStats:
     return result
 
 
-def get_journeys_stats(journeys: Journeys, params: Params = None, max_count=None, shape=None) -> JourneyStats:
+def _get_option_stats_with_trace(option: Option, shape=None):
+    """
+    Get the stats for a route option in a worker process
+    :param option: the route option
+    :param shape: (optional) a shape to filter for
+    :return: the stats and the trace if it was built by this call (None otherwise)
+    """
+    built_trace = option.trace is None
+    stats = get_option_stats(option, shape=shape)
+    return stats, option.trace if built_trace else None
+
+
+def get_options_stats(options: list[Option], shape=None, processes=None, executor: Executor = None,
+                      keep_traces=False) -> list[JourneyStats]:
+    """
+    Get the stats for a list of route options. The options are split into chunks that are processed in parallel, a
+    few options are processed in this process.
+    :param options: the route options
+    :param shape: (optional) a shape to filter for
+    :param processes: (optional) the number of worker processes, defaults to the number of CPUs
+    :param executor: (optional) a process pool to use, so repeated calls don't start a new pool each time
+    :param keep_traces: (optional) whether to send the traces built by the worker processes back and store them on the
+        options, so they are not rebuilt on the next call. This costs about as much transfer as sending the options.
+    :return: the stats of each option, in the same order as the options
+    """
+    if len(options) < 2 * stats_chunksize:
+        return [get_option_stats(option, shape=shape) for option in options]
+
+    if executor is None:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            return get_options_stats(options, shape=shape, executor=executor, keep_traces=keep_traces)
+
+    if not keep_traces:
+        return list(executor.map(partial(get_option_stats, shape=shape), options, chunksize=stats_chunksize))
+
+    results = list(executor.map(partial(_get_option_stats_with_trace, shape=shape), options, chunksize=stats_chunksize))
+
+    for (option, (_, trace)) in zip(options, results):
+        if trace is not None:
+            option.trace = trace
+
+    return [stats for (stats, _) in results]
+
+
+def get_journeys_stats(journeys: Journeys, params: Params = None, max_count=None, shape=None,
+                       executor: Executor = None) -> JourneyStats:
     """
     Get the modal share for a set of route options
     :param journeys: the journeys
     :param params: (optional) the simulation parameters
     :param max_count: (optional) the maximum number of route options to consider
     :param shape: (optional) a shape to filter for
+    :param executor: (optional) a process pool to use for the stats (see get_options_stats)
     :return: a dictionary with the modal share
     """
     if params is None:
@@ -106,7 +159,7 @@ def get_journeys_stats(journeys: Journeys, params: Params = None, max_count=None
 
     selection = journeys.get_selection(lambda options: decide(options, params), max_count=max_count)
 
-    option_stats = [get_option_stats(option, shape=shape) for option in journeys.iterate_selection(selection)]
+    option_stats = get_options_stats(list(journeys.iterate_selection(selection)), shape=shape, executor=executor)
 
     return merge_journey_stats(option_stats)
 
@@ -154,20 +207,27 @@ def plot_monte_carlo_convergence(journeys: Journeys, city_name: str, shape=None,
     num_to_plot = 1
     num_steps = 100
 
-    t = datetime.datetime.now()
+    t = time.perf_counter_ns()
 
     selection = journeys.get_selection(lambda options: decide(options, params))
 
-    stats = [get_option_stats(option, shape=shape) for option in journeys.iterate_selection(selection)]
-    print(f"Calculating stats took {(datetime.datetime.now() - t).total_seconds()} seconds")
+    stats = get_options_stats(list(journeys.iterate_selection(selection)), shape=shape)
+    log.debug("Calculating stats took %.3fms", (time.perf_counter_ns() - t) / 1e6)
 
     num_to_plot_add = int(len(journeys.options) / num_steps)
 
+    # running totals of the stats, row i holds the merged stats of the first i options
+    totals = np.zeros((len(stats) + 1, 8))
+    totals[1:] = np.cumsum(np.array([[s.car_meters, s.rail_meters, s.bus_meters, s.walk_meters,
+                                      s.car_passengers, s.rail_passengers, s.bus_passengers, s.walkers]
+                                     for s in stats]).reshape(-1, 8), axis=0)
+
     modal_shares = []
     vc_count = []
 
     for i in range(num_steps):
-        sub_stats = merge_journey_stats(stats[:num_to_plot])
+        sub_totals = totals[min(num_to_plot, len(stats))].tolist()
+        sub_stats = JourneyStats.from_buckets(sub_totals[:4], sub_totals[4:])
         modal_share = sub_stats.get_all_modal_shares()
         modal_shares.append(modal_share)
         vc_count.append(num_to_plot)
@@ -225,13 +285,15 @@ def plot_transit_monte_carlo_convergence(journeys: Journeys, city_name=None, par
     modal_shares = []
     vc_count = []
 
-    for i in range(num_steps):
-        print("Running for " + str(num_to_plot) + " results")
-        stats = get_journeys_stats(journeys, params=params, max_count=num_to_plot)
-        modal_share = stats.get_transit_modal_share()
-        modal_shares.append(modal_share)
-        vc_count.append(num_to_plot)
-        num_to_plot += num_to_plot_add
+    # one pool for all steps instead of starting one per step
+    with ProcessPoolExecutor() as executor:
+        for i in range(num_steps):
+            log.debug("Running for %d results", num_to_plot)
+            stats = get_journeys_stats(journeys, params=params, max_count=num_to_plot, executor=executor)
+            modal_share = stats.get_transit_modal_share()
+            modal_shares.append(modal_share)
+            vc_count.append(num_to_plot)
+            num_to_plot += num_to_plot_add
 
     # plot all to same graph
 
@@ -274,6 +336,8 @@ def analyze_waling_distances(journeys: Journeys, city_name=None):
 
 # todo use random.systemrandom() instead of random.random() for better randomness
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
     # t = datetime.datetime.now()
     # jrn = Journeys("bd6809da-8113-469f-91cc-501549e8df68")
     # print(f"Loading journeys took {(datetime.datetime.now() - t).total_seconds()} seconds")
@@ -1,8 +1,15 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
 from hiveline.od.place import Place
 from hiveline.plotting.map import CityPlotter, get_line_traces_by_mode, add_line_traces
 from hiveline.results.journeys import Journeys
 from hiveline.results.modal_shares import decide, Params
 
+log = logging.getLogger(__name__)
+
 
 def _prepare_traces(journeys: Journeys, only_use_selected=True):
     selection: list[str] | None = None
@@ -10,48 +17,58 @@ def _prepare_traces(journeys: Journeys, only_use_selected=True):
     if only_use_selected:
         selection = journeys.get_selection(lambda options: decide(options, Params()))
 
-    print("Extracting traces...")
+    log.info("Extracting traces...")
 
     return [trace for trace in journeys.iterate_traces(selection)]
 
 
-def plot_trace_animation(journeys: Journeys, only_use_selected=True, zoom_level=13, tall_city=False, fps=30,
+def plot_trace_animation(journeys: Journeys, place, only_use_selected=True, zoom_level=13, tall_city=False, fps=30,
                          duration=30):
     raw_traces = _prepare_traces(journeys, only_use_selected=only_use_selected)
 
-    print("Plotting traces...")
+    log.info("Plotting traces...")
 
     total_frames = fps * duration
 
-    num_to_plot = 0
-    num_step = int(len(raw_traces) / total_frames)
+    # frame i adds the traces from frame_bounds[i] to frame_bounds[i + 1], so every trace is added exactly once
+    frame_bounds = np.linspace(0, len(raw_traces), total_frames + 1).astype(int).tolist()
 
     plotter = CityPlotter(place, zoom=zoom_level)
     webdriver = plotter.setup_webdriver()
 
     traces = {}
 
-    for i in range(total_frames):
-        print(f"Frame {i} of {total_frames}")
+    # the next frame is built while the previous one is exported. there is only one webdriver, so exports run one at a
+    # time on a single worker thread
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        export = None
 
-        raw_to_add = raw_traces[num_to_plot:num_to_plot + num_step]
-        traces_to_add = get_line_traces_by_mode(raw_to_add)
-        traces = add_line_traces(traces, traces_to_add)
+        for i in range(total_frames):
+            log.debug("Frame %d of %d", i, total_frames)
 
-        plotter.get_map(zoom=zoom_level, dark=True)
-        plotter.add_traces(traces)
+            raw_to_add = raw_traces[frame_bounds[i]:frame_bounds[i + 1]]
+            traces_to_add = get_line_traces_by_mode(raw_to_add)
+            traces = add_line_traces(traces, traces_to_add)
 
-        plotter.export_to_png(folder="animation", filename=sim_id + "-frame-" + str(i), tall_city=tall_city,
-                              webdriver=webdriver)
+            plotter.map = plotter.get_map(zoom=zoom_level, dark=True)
+            plotter.add_traces(traces)
 
-        num_to_plot += num_step
+            if export is not None:
+                export.result()
+
+            export = executor.submit(plotter.export_to_png, folder="animation",
+                                     filename=journeys.sim_id + "-frame-" + str(i), tall_city=tall_city,
+                                     webdriver=webdriver, folium_map=plotter.map)
+
+        if export is not None:
+            export.result()
 
 
 def plot_traces(journeys: Journeys, place, only_use_selected=True, folder="images/", filename="image"):
     raw_traces = _prepare_traces(journeys, only_use_selected=only_use_selected)
     traces = get_line_traces_by_mode(raw_traces)
 
-    print("Plotting traces...")
+    log.info("Plotting traces...")
 
     plotter = CityPlotter(place, zoom=11)
 
@@ -62,9 +79,11 @@ def plot_traces(journeys: Journeys, place, only_use_selected=True, folder="image
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
     sim_place = Place("Eindhoven, Netherlands", '2020')
     jrn = Journeys("614aab43-b799-46cd-a1aa-bdb9e739d525")
     plot_traces(jrn, sim_place)
-    # plot_trace_animation("614aab43-b799-46cd-a1aa-bdb9e739d525", place, zoom_level=11,
+    # plot_trace_animation(jrn, sim_place, zoom_level=11,
     #                only_use_selected=True,
     #                fps=30, duration=2, tall_city=True)
@@ -1,17 +1,28 @@
 import datetime
-import json
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+
 from hiveline.routing.clients.routing_client import RoutingClient
 from hiveline.models import fptf
 
 
 class BifrostRoutingClient(RoutingClient):
-    def __init__(self, client_timeout=40):
+    def __init__(self, client_timeout=40, pool_size=32):
         """
         :param client_timeout: timeout for the request
+        :param pool_size: the maximum number of connections kept open to the server (one per routing thread)
         """
         self.client_timeout = client_timeout
+        self.mode_strings = {}  # tuple of modes -> list of mode strings for the request
+
+        # reuse connections across requests instead of opening a new one for every route
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.session.headers.update({
+            'Content-Type': 'application/json'
+        })
 
     def get_journeys(self, from_lat: float, from_lon: float, to_lat: float, to_lon: float, departure: datetime.datetime,
                      modes: list[fptf.Mode]) -> list[fptf.Journey] | None:
@@ -44,25 +55,28 @@ class BifrostRoutingClient(RoutingClient):
         # set time zone to CET
         departure = departure.astimezone(datetime.timezone(datetime.timedelta(hours=1)))
 
+        mode_key = tuple(modes)
+        mode_strings = self.mode_strings.get(mode_key)
+
+        if mode_strings is None:
+            mode_strings = [mode.to_string() for mode in modes]
+            self.mode_strings[mode_key] = mode_strings
+
         req = {
             "origin": origin,
             "destination": destination,
-            "modes": [mode.to_string() for mode in modes],
+            "modes": mode_strings,
             "departure": departure.isoformat()
         }
 
-        headers = {
-            'Content-Type': 'application/json'
-        }
-
-        # Send the request to the OTP GraphQL endpoint
-        response = requests.post(url, json=req, headers=headers, timeout=self.client_timeout)
+        # Send the request to the Bifrost endpoint
+        response = self.session.post(url, data=orjson.dumps(req), timeout=self.client_timeout)
 
         if response.status_code != 200:
             print("Error querying Bifrost:", response.status_code)
             print(response.text)
             return None
 
-        result = response.json()
+        result = orjson.loads(response.content)
 
-        return [fptf.journey_from_json(result)]
+        return [fptf.journey_from_dict(result)]
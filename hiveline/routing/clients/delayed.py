@@ -1,4 +1,6 @@
+import bisect
 import datetime
+import threading
 
 import numpy as np
 
@@ -7,6 +9,24 @@ from hiveline.mongo.db import get_database
 from hiveline.routing.clients.routing_client import RoutingClient
 
 
+_delay_statistics = None
+_delay_statistics_lock = threading.Lock()
+
+
+def _get_delay_statistics():
+    """
+    This function returns the delay statistics. They are only read from the database once per process and shared by
+    all clients.
+    """
+    global _delay_statistics
+
+    with _delay_statistics_lock:
+        if _delay_statistics is None:
+            _delay_statistics = _read_delay_statistics()
+
+    return _delay_statistics
+
+
 def _read_delay_statistics():
     """
     This function reads the delay statistics from the database
@@ -19,19 +39,23 @@ def _read_delay_statistics():
 
     for doc in coll.find():
         name = doc["name"]
-        starts = doc["starts"]
-        weights = doc["weights"]
+        starts = np.asarray(doc["starts"], dtype=np.int64)
+        weights = np.asarray(doc["weights"], dtype=np.float64)
         substituted_percent = doc["substituted_percent"]
         cancelled_percent = doc["cancelled_percent"]
 
-        identity = list(range(len(starts)))
+        cumulative_weights = np.cumsum(weights)
+
+        # the arrays are shared by all clients and threads, so they must never be modified
+        for array in (starts, weights, cumulative_weights):
+            array.flags.writeable = False
 
         delay_data[name] = {
             "starts": starts,
             "weights": weights,
+            "cumulative_weights": cumulative_weights,
             "substituted_percent": substituted_percent,
-            "cancelled_percent": cancelled_percent,
-            "identity": identity
+            "cancelled_percent": cancelled_percent
         }
 
     return delay_data
@@ -41,59 +65,96 @@ def _get_fastest_journey(journeys):
     """
     This function returns the fastest journey from the list of journeys
 
-    :param journeys: list of journeys
-    :return: the fastest journey
+    :param journeys: list of journeys (may be None)
+    :return: the fastest journey or None if there are no journeys
     """
-    durations = [journey.duration() for journey in journeys]
-    min_duration = min(durations)
-    min_index = durations.index(min_duration)
-    return journeys[min_index]
+    if journeys is None:
+        return None
+
+    return min(journeys, key=lambda journey: journey.duration(), default=None)
 
 
 class DelayedRoutingClient(RoutingClient):
-    def __init__(self, base: RoutingClient):
+    def __init__(self, base: RoutingClient, seed=None):
+        """
+        :param base: the routing client to query for journeys
+        :param seed: (optional) a seed for the random delays, to make simulations reproducible
+        """
         # This dictionary stores the delay data for each operator
-        self.delay_data = _read_delay_statistics()
+        self.delay_data = _get_delay_statistics()
+        # This dictionary maps raw operator names to their entry in delay_data
+        self.operator_delay_data = {}
         self.base = base
+        self.rng = np.random.default_rng(seed)
+        self.rng_lock = threading.Lock()  # the generator is shared by all routing threads
 
-    def __get_random_delay(self, operator_name):
+    def __draw_rolls(self, leg_count):
         """
-        This function returns a random delay for the specified operator. The delay is either cancelled or a random value
-        between the specified interval.
+        This function draws the random numbers for the delays of a journey at once
+
+        :param leg_count: the number of legs of the journey
+        :return: an array with one row of (cancel roll, bin roll, minute roll) in [0, 1) per leg
+        """
+        with self.rng_lock:
+            return self.rng.random((leg_count, 3))
+
+    def __get_operator_delay_data(self, operator_name):
+        """
+        This function returns the delay statistics of the specified operator, falling back to the average statistics
+        for unknown operators. The lookup is only done once per operator name.
 
         :param operator_name: the name of the operator
-        :return: a dictionary with the keys "cancelled" and "delay"
+        :return: the delay statistics of the operator
+        """
+        data = self.operator_delay_data.get(operator_name)
+        if data is not None:
+            return data
+
+        data = self.delay_data.get(operator_name.lower())
+        if data is None:
+            data = self.delay_data["average"]
+
+        self.operator_delay_data[operator_name] = data
+        return data
+
+    @staticmethod
+    def __get_random_delay(delay_data, rolls):
         """
+        This function returns a random delay for an operator. The delay is either cancelled or a random value
+        between the specified interval.
 
-        operator_name = operator_name.lower()
-        if operator_name not in self.delay_data:
-            operator_name = "average"
+        :param delay_data: the delay statistics of the operator (from __get_operator_delay_data)
+        :param rolls: the (cancel roll, bin roll, minute roll) of the leg (from __draw_rolls)
+        :return: a dictionary with the keys "cancelled" and "delay"
+        """
+        cancel_roll, bin_roll, minute_roll = rolls.tolist()
 
-        cancelled_percent = self.delay_data[operator_name]["cancelled_percent"]
+        cancelled_percent = delay_data["cancelled_percent"]
 
-        if np.random.random() * 100 < cancelled_percent:
+        if cancel_roll * 100 < cancelled_percent:
             return {
                 "cancelled": True
             }
 
-        starts = self.delay_data[operator_name]["starts"]
-        identity = self.delay_data[operator_name]["identity"]
-        weights = self.delay_data[operator_name]["weights"]
+        starts = delay_data["starts"]
+        cumulative_weights = delay_data["cumulative_weights"]
 
-        key = np.random.choice(identity, p=weights)
-        interval_start = starts[key]
+        # pick a bin with probability proportional to its weight
+        key = int(np.searchsorted(cumulative_weights, bin_roll * cumulative_weights[-1], side="right"))
+        interval_start = int(starts[key])
         interval_end = interval_start + 5
         if key < len(starts) - 1:
-            interval_end = starts[key + 1]
+            interval_end = int(starts[key + 1])
 
-        val = np.random.randint(interval_start, interval_end)
+        val = interval_start + int(minute_roll * (interval_end - interval_start))
 
         return {
             "cancelled": False,
             "delay": val
         }
 
-    time_dependent_modes = [fptf.Mode.TRAIN, fptf.Mode.BUS, fptf.Mode.WATERCRAFT, fptf.Mode.AIRCRAFT, fptf.Mode.GONDOLA]
+    time_dependent_modes = frozenset({fptf.Mode.TRAIN, fptf.Mode.BUS, fptf.Mode.WATERCRAFT, fptf.Mode.AIRCRAFT,
+                                      fptf.Mode.GONDOLA})
 
     def get_journeys(self, from_lat, from_lon, to_lat, to_lon, departure, modes):
         """
@@ -124,20 +185,26 @@ class DelayedRoutingClient(RoutingClient):
         for call in range(max_calls):
             steps = 0
 
+            rolls = self.__draw_rolls(len(journey.legs))
+
             current_delay = 0  # in minutes
 
+            # positions of the time dependent legs and the delay statistics of their operators
+            td_positions = [i for (i, leg) in enumerate(journey.legs) if leg.mode in self.time_dependent_modes]
+            td_delay_data = [self.__get_operator_delay_data(journey.legs[i].operator.name) for i in td_positions]
+
             # iterate legs
             leg_count = len(journey.legs)
             while steps < leg_count:
                 time_independent_start = steps
 
-                while steps < leg_count:
-                    leg = journey.legs[steps]
+                # jump to the next time dependent leg, the legs up to it keep the current delay
+                next_td = bisect.bisect_left(td_positions, steps)
+                steps = td_positions[next_td] if next_td < len(td_positions) else leg_count
+
+                for leg in journey.legs[time_independent_start:steps + 1]:
                     leg.departure_delay = current_delay * 60
                     leg.arrival_delay = current_delay * 60
-                    if leg.mode in self.time_dependent_modes:
-                        break
-                    steps += 1
 
                 if steps >= leg_count:
                     # we can catch the last connection
@@ -151,11 +218,8 @@ class DelayedRoutingClient(RoutingClient):
                 # legs[steps] is a time dependent leg
                 leg = journey.legs[steps]
 
-                # get the operator name
-                operator_name = leg.operator.name
-
                 # get the delay
-                delay = self.__get_random_delay(operator_name)
+                delay = self.__get_random_delay(td_delay_data[next_td], rolls[steps])
 
                 # check if the connection is cancelled
                 if delay["cancelled"]:
@@ -184,17 +248,17 @@ class DelayedRoutingClient(RoutingClient):
             # we cannot catch the last connection
             result_legs += journey.legs[:steps]
 
-            # route from the last station to the destination
-            last_leg = journey.legs[0]
-            position = last_leg.origin
-            new_dep = last_leg.departure
+            # route from the last station to the destination (or from the start if the first leg was missed)
             if steps > 0:
                 last_leg = journey.legs[steps - 1]
                 position = last_leg.destination
                 new_dep = last_leg.arrival + datetime.timedelta(seconds=last_leg.arrival_delay)
+            else:
+                first_leg = journey.legs[0]
+                position = first_leg.origin
+                new_dep = first_leg.departure
 
-            pos_lon = position.longitude
-            pos_lat = position.latitude
+            pos_lat, pos_lon = position.latitude, position.longitude
 
             journey = _get_fastest_journey(self.base.get_journeys(pos_lat, pos_lon, to_lat, to_lon, new_dep, modes))
             re_calc_count += 1
@@ -1,19 +1,134 @@
 import datetime
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+import orjson
 import polyline
 import requests
+from requests.adapters import HTTPAdapter
 
 from hiveline.routing.clients.routing_client import RoutingClient
 from hiveline.models import fptf
 
 
+_graphql_url = "http://localhost:8080/otp/routers/default/index/graphql"
+_graphql_batch_url = "http://localhost:8080/otp/routers/default/index/graphql/batch"
+
+
+# the plan query is the same for every request, only the variables change
+_plan_query = """
+query Plan($fromLat: Float!, $fromLon: Float!, $toLat: Float!, $toLon: Float!, $date: String!, $time: String!,
+           $transportModes: [TransportMode]) {
+    plan(
+        from: {lat: $fromLat, lon: $fromLon}
+        to: {lat: $toLat, lon: $toLon}
+        date: $date
+        time: $time
+        transportModes: $transportModes) {
+        itineraries {
+            startTime
+            endTime
+            legs {
+                mode
+                startTime
+                endTime
+                agency {
+                    id
+                    name
+                    gtfsId
+                }
+                from {
+                    stop {
+                        gtfsId
+                    }
+                    name
+                    lat
+                    lon
+                    departureTime
+                    arrivalTime
+                }
+                to {
+                    stop {
+                        gtfsId
+                    }
+                    name
+                    lat
+                    lon
+                    departureTime
+                    arrivalTime
+                }
+                route {
+                    gtfsId
+                    longName
+                    shortName
+                }
+                intermediatePlaces {
+                    stop {
+                        gtfsId
+                    }
+                    name
+                    lon
+                    lat
+                    departureTime
+                    arrivalTime
+                }
+                legGeometry {
+                    points
+                }
+            }
+        }
+    }
+}
+"""
+
+
+# fptf mode -> otp transport modes
+_fptf_to_otp_modes = {
+    fptf.Mode.WALKING: ("WALK",),
+    fptf.Mode.BUS: ("BUS", "TROLLEYBUS"),
+    fptf.Mode.TRAIN: ("RAIL", "TRAM", "SUBWAY", "CABLE_CAR", "FUNICULAR", "MONORAIL"),
+    fptf.Mode.GONDOLA: ("GONDOLA",),
+    fptf.Mode.AIRCRAFT: ("AIRPLANE",),
+    fptf.Mode.WATERCRAFT: ("FERRY",),
+    fptf.Mode.TAXI: ("TAXI",),
+    fptf.Mode.BICYCLE: ("BIKE",),
+    fptf.Mode.CAR: ("CAR",),
+}
+
+
+@functools.lru_cache(maxsize=64)
+def _get_otp_transport_modes(modes: tuple[fptf.Mode, ...]) -> list[dict]:
+    """
+    Get the transportModes variable of an OTP query for the given fptf modes. Routing uses only a few mode
+    combinations, so the lists are cached (and must not be modified).
+    :param modes: the fptf modes
+    :return: the transport modes
+    """
+    return [{"mode": otp_mode} for mode in modes for otp_mode in _fptf_to_otp_modes.get(mode, ())]
+
+
 class OpenTripPlannerRoutingClient(RoutingClient):
-    def __init__(self, client_timeout=40):
+    def __init__(self, client_timeout=40, pool_size=32, cache_size=1000):
         """
         :param client_timeout: timeout for the request
+        :param pool_size: the maximum number of connections kept open to the server (one per routing thread)
+        :param cache_size: the maximum number of plan responses to keep for repeated queries (0 to disable)
         """
         self.client_timeout = client_timeout
 
+        # successful plan responses by query, the oldest entry is dropped when the cache is full
+        self.cache_size = cache_size
+        self.plan_cache = {}
+        self.plan_cache_lock = threading.Lock()
+
+        # reuse connections across requests instead of opening a new one for every route
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.session.headers.update({
+            'Content-Type': 'application/json'
+        })
+
     def get_journeys(self, from_lat: float, from_lon: float, to_lat: float, to_lon: float, departure: datetime.datetime,
                      modes: list[fptf.Mode]) -> list[fptf.Journey] | None:
         """
@@ -28,280 +143,249 @@ class OpenTripPlannerRoutingClient(RoutingClient):
 
         :return: a single fptf journey
         """
+        variables = _get_plan_variables(from_lat, from_lon, to_lat, to_lon, departure, modes)
 
-        if modes is None:
-            modes = [fptf.Mode.WALKING, fptf.Mode.TRAIN, fptf.Mode.BUS]
-
-        # get otp modes from fptf modes
-        otp_modes = []
-        for mode in modes:
-            if mode == fptf.Mode.WALKING:
-                otp_modes.append("WALK")
-            elif mode == fptf.Mode.BUS:
-                otp_modes.append("BUS")
-                otp_modes.append("TROLLEYBUS")
-            elif mode == fptf.Mode.TRAIN:
-                otp_modes.append("RAIL")
-                otp_modes.append("TRAM")
-                otp_modes.append("SUBWAY")
-                otp_modes.append("CABLE_CAR")
-                otp_modes.append("FUNICULAR")
-                otp_modes.append("MONORAIL")
-            elif mode == fptf.Mode.GONDOLA:
-                otp_modes.append("GONDOLA")
-            elif mode == fptf.Mode.AIRCRAFT:
-                otp_modes.append("AIRPLANE")
-            elif mode == fptf.Mode.WATERCRAFT:
-                otp_modes.append("FERRY")
-            elif mode == fptf.Mode.TAXI:
-                otp_modes.append("TAXI")
-            elif mode == fptf.Mode.BICYCLE:
-                otp_modes.append("BIKE")
-            elif mode == fptf.Mode.CAR:
-                otp_modes.append("CAR")
-
-        # build query
-        url = "http://localhost:8080/otp/routers/default/index/graphql"
-
-        date = departure.strftime("%Y-%m-%d")
-        time = departure.strftime("%H:%M")
-
-        mode_str = '{mode: ' + '} {mode:'.join(otp_modes) + '}'
-
-        query = """
-        {
-            plan(
-                from: { lat:%s,lon:%s}
-                to: {lat:%s,lon:%s}
-                date: "%s"
-                time: "%s"
-              
-                transportModes: [%s]) {
-                itineraries {
-                    startTime
-                    endTime
-                    legs {
-                        mode
-                        startTime
-                        endTime
-                        agency {
-                            id
-                            name
-                            gtfsId
-                        }
-                        from {
-                            stop {
-                                gtfsId
-                            }
-                            name
-                            lat
-                            lon
-                            departureTime
-                            arrivalTime
-                        }
-                        to {
-                            stop {
-                                gtfsId
-                            }
-                            name
-                            lat
-                            lon
-                            departureTime
-                            arrivalTime
-                        }
-                        route {
-                            gtfsId
-                            longName
-                            shortName
-                        }
-                        intermediatePlaces {
-                            stop {
-                                gtfsId
-                            }
-                            name
-                            lon
-                            lat
-                            departureTime
-                            arrivalTime
-                        }
-                        legGeometry {
-                            points
-                        }
-                    }
-                }
-            }
-        }
-        """ % (from_lat, from_lon, to_lat, to_lon, date, time, mode_str)
-
-        headers = {
-            'Content-Type': 'application/json'
-        }
+        json_data = self.__get_cached_plan(variables)
+        if json_data is not None:
+            return _transform_plan_response(json_data, variables)
 
         # Send the request to the OTP GraphQL endpoint
-        response = requests.post(url, json={'query': query}, headers=headers, timeout=self.client_timeout)
+        response = self.session.post(_graphql_url, data=orjson.dumps({'query': _plan_query, 'variables': variables}),
+                                     timeout=self.client_timeout)
 
         # Check if the request was successful
         if response.status_code != 200:
             print("Error querying OpenTripPlanner:", response.status_code)
-            print(response.json())
+            print(response.text)
 
             return None
 
-        json_data = response.json()
-
-        if not json_data or "data" not in json_data or "errors" in json_data:
-            print("OTP may have failed to parse the request. Query:")
-            print(query)
-            print("Response:")
-            print(json_data)
+        json_data = orjson.loads(response.content)
+        self.__cache_plan(variables, json_data)
 
-            return None
+        return _transform_plan_response(json_data, variables)
 
-        otp_resp = OtpResponse(json_data)
+    def get_journeys_batch(self, queries: list[tuple[float, float, float, float, datetime.datetime, list[fptf.Mode]]],
+                           max_workers=16, batch_size=16) -> list[list[fptf.Journey] | None]:
+        """
+        Get routes for many independent queries. The queries are sent in batches of batch_size plan queries per HTTP
+        request to the OTP GraphQL batch endpoint, and the batches are sent from a thread pool. If the server rejects a
+        batch, its queries are sent one by one instead.
+        :param queries: the (from_lat, from_lon, to_lat, to_lon, departure, modes) arguments of each get_journeys call
+        :param max_workers: the maximum number of batches in flight
+        :param batch_size: the number of queries per batch
+        :return: the result of get_journeys for each query, in the same order as the queries
+        """
+        batches = [queries[i:i + batch_size] for i in range(0, len(queries), batch_size)]
 
-        journeys = otp_resp.transform()
-        if len(journeys) == 0:
-            return []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(self.__get_journeys_batch, batches)
 
-        return journeys
+            return [journeys for batch_journeys in results for journeys in batch_journeys]
 
+    def __get_journeys_batch(self, queries):
+        """
+        Send one batch of queries in a single request
+        :param queries: the get_journeys arguments of each query
+        :return: the result of get_journeys for each query
+        """
+        variables = [_get_plan_variables(*query) for query in queries]
+        plans = [self.__get_cached_plan(v) for v in variables]
 
-class OtpResponse:
-    def __init__(self, data):
-        self.itineraries = [OtpItinerary(itinerary) for itinerary in data['data']['plan']['itineraries']]
+        # only send the queries that are not cached
+        missing = [i for (i, plan) in enumerate(plans) if plan is None]
 
-    def transform(self):
-        return [itinerary.transform() for itinerary in self.itineraries]
+        if len(missing) > 0:
+            response = self.session.post(_graphql_batch_url,
+                                         data=orjson.dumps([{'query': _plan_query, 'variables': variables[i]}
+                                                            for i in missing]),
+                                         timeout=self.client_timeout)
 
+            json_data = orjson.loads(response.content) if response.status_code == 200 else None
 
-class OtpItinerary:
-    def __init__(self, itinerary):
-        self.start_time = itinerary['startTime']
-        self.end_time = itinerary['endTime']
-        self.legs = [OtpLeg(leg) for leg in itinerary['legs']]
+            if type(json_data) is not list or len(json_data) != len(missing):
+                print("OTP did not accept the batch request, querying one by one")
+                return [self.get_journeys(*query) for query in queries]
 
-    def transform(self):
-        return fptf.Journey(
-            id=None,
-            legs=[leg.transform() for leg in self.legs],
-        )
+            for (i, data) in zip(missing, json_data):
+                self.__cache_plan(variables[i], data)
+                plans[i] = data
 
+        return [_transform_plan_response(data, v) for (data, v) in zip(plans, variables)]
 
-class OtpLeg:
-    def __init__(self, leg):
-        self.mode = leg['mode']
-        self.start_time = leg['startTime']
-        self.end_time = leg['endTime']
-        self.agency = OtpAgency(leg['agency']) if 'agency' in leg and leg['agency'] else None
-        self.from_place = OtpPlace(leg['from'])
-        self.to = OtpPlace(leg['to'])
-        self.route = OtpRoute(leg['route']) if 'route' in leg and leg['route'] else None
-        self.intermediate_places = [OtpPlace(place) for place in
-                                    leg['intermediatePlaces']] if 'intermediatePlaces' in leg and leg[
-            'intermediatePlaces'] else []
-        self.geometry = leg['legGeometry']['points'] if 'legGeometry' in leg and 'points' in leg['legGeometry'] else ''
-
-    def transform(self):
-        mode = transform_mode(self.mode)
-        return fptf.Leg(
-            origin=self.from_place.transform_to_stop_station(),
-            destination=self.to.transform_to_stop_station(),
-            departure=self.from_place.transform_to_departure(),
-            arrival=self.to.transform_to_arrival(),
-            mode=mode,
-            sub_mode=self.mode.lower(),
-            operator=self.agency.transform() if self.agency else None,
-            line=self.route.transform(mode) if self.route else None,
-            stopovers=self.transform_stopovers(),
-            polyline=self.geometry if self.geometry else None
-        )
-
-    def transform_stopovers(self):
-        if self.intermediate_places:
-            return [place.transform_to_stopover() for place in [self.from_place] + self.intermediate_places + [self.to]]
-        return [self.from_place.transform_to_stopover(), self.to.transform_to_stopover()]
+    def __get_cached_plan(self, variables):
+        """
+        Get the cached response to a plan query. The journeys are rebuilt from it on every call, as callers may
+        modify them (e.g. to add delays).
+        :param variables: the variables of the query
+        :return: the decoded response or None if it is not cached
+        """
+        if self.cache_size <= 0:
+            return None
 
+        with self.plan_cache_lock:
+            return self.plan_cache.get(_get_plan_key(variables))
 
-def transform_mode(mode):
-    modes = {
-        'WALK': fptf.Mode.WALKING,
-        'BUS': fptf.Mode.BUS,
-        'RAIL': fptf.Mode.TRAIN,
-        'TRAM': fptf.Mode.TRAIN,
-        'SUBWAY': fptf.Mode.TRAIN,
-        'TRANSIT': fptf.Mode.TRAIN,
-        'BICYCLE': fptf.Mode.BICYCLE,
-        'CAR': fptf.Mode.CAR
+    def __cache_plan(self, variables, json_data):
+        """
+        Cache the response to a plan query if it was successful
+        :param variables: the variables of the query
+        :param json_data: the decoded response
+        """
+        if self.cache_size <= 0 or not json_data or "data" not in json_data or "errors" in json_data:
+            return
+
+        with self.plan_cache_lock:
+            if len(self.plan_cache) >= self.cache_size:
+                del self.plan_cache[next(iter(self.plan_cache))]
+
+            self.plan_cache[_get_plan_key(variables)] = json_data
+
+
+def _get_plan_variables(from_lat: float, from_lon: float, to_lat: float, to_lon: float, departure: datetime.datetime,
+                        modes: list[fptf.Mode]) -> dict:
+    """
+    Get the variables of a plan query
+    :return: the variables (see get_journeys for the parameters)
+    """
+    if modes is None:
+        modes = [fptf.Mode.WALKING, fptf.Mode.TRAIN, fptf.Mode.BUS]
+
+    # coordinates are rounded to ~1m, so repeated trips between the same places share a cache entry
+    return {
+        "fromLat": round(from_lat, 5),
+        "fromLon": round(from_lon, 5),
+        "toLat": round(to_lat, 5),
+        "toLon": round(to_lon, 5),
+        "date": departure.strftime("%Y-%m-%d"),
+        "time": departure.strftime("%H:%M"),
+        "transportModes": _get_otp_transport_modes(tuple(modes))
     }
-    return modes.get(mode, '')
-
-
-class OtpAgency:
-    def __init__(self, agency):
-        self.id = agency['id']
-        self.name = agency['name']
-        self.gtfs_id = agency['gtfsId']
-
-    def transform(self):
-        return fptf.Operator(
-            id=self.id,
-            name=self.name
-        )
-
 
-class OtpPlace:
-    def __init__(self, place):
-        self.stop = OtpStop(place['stop']) if 'stop' in place and place['stop'] else None
-        self.name = place['name']
-        self.lat = place['lat']
-        self.lon = place['lon']
-        self.departure_time = place['departureTime']
-        self.arrival_time = place['arrivalTime']
-
-    def transform_to_stop_station(self):
-        id = self.stop.gtfs_id if self.stop else ''
-        return fptf.Station(
-            id=id,
-            name=self.name,
-            location=fptf.Location(
-                latitude=self.lat,
-                longitude=self.lon
-            )
-        )
 
-    def transform_to_departure(self):
-        return datetime.datetime.fromtimestamp(self.departure_time / 1000)
+def _get_plan_key(variables: dict) -> tuple:
+    """
+    Get the cache key of a plan query. Departures are already bucketed to the minute by the variables.
+    :param variables: the variables of the query
+    :return: the key
+    """
+    return (variables["fromLat"], variables["fromLon"], variables["toLat"], variables["toLon"], variables["date"],
+            variables["time"], tuple(m["mode"] for m in variables["transportModes"]))
+
+
+def _transform_plan_response(json_data, variables) -> list[fptf.Journey] | None:
+    """
+    Transform the response to a plan query into fptf journeys
+    :param json_data: the decoded response
+    :param variables: the variables of the query (for error reporting)
+    :return: the journeys or None if the query failed
+    """
+    if not json_data or "data" not in json_data or "errors" in json_data:
+        print("OTP may have failed to parse the request. Variables:")
+        print(variables)
+        print("Response:")
+        print(json_data)
+
+        return None
+
+    return [_transform_itinerary(itinerary) for itinerary in json_data['data']['plan']['itineraries']]
+
+
+def _transform_itinerary(itinerary) -> fptf.Journey:
+    """
+    Transform an OTP itinerary into a fptf journey
+    :param itinerary: the itinerary dictionary of the response
+    :return: the journey
+    """
+    # consecutive legs and their places share most timestamps, so each distinct timestamp is only converted once
+    times = {}
+
+    return fptf.Journey(
+        id=None,
+        legs=[_transform_leg(leg, times) for leg in itinerary['legs']],
+    )
+
+
+def _transform_leg(leg, times: dict) -> fptf.Leg:
+    """
+    Transform an OTP leg into a fptf leg
+    :param leg: the leg dictionary of the response
+    :param times: the datetimes of the timestamps converted so far
+    :return: the leg
+    """
+    otp_mode = leg['mode']
+    mode = transform_mode(otp_mode)
+
+    from_place = leg['from']
+    to_place = leg['to']
+    intermediate_places = leg.get('intermediatePlaces') or []
+    agency = leg.get('agency')
+    route = leg.get('route')
+    geometry = (leg.get('legGeometry') or {}).get('points')
+
+    return fptf.Leg(
+        origin=_transform_station(from_place),
+        destination=_transform_station(to_place),
+        departure=_get_time(times, from_place['departureTime']),
+        arrival=_get_time(times, to_place['arrivalTime']),
+        mode=mode,
+        sub_mode=otp_mode.lower(),
+        operator=fptf.Operator(id=agency['id'], name=agency['name']) if agency else None,
+        line=fptf.Line(id=route['gtfsId'], name=route['longName'], mode=mode, routes=None,
+                       operator=None) if route else None,
+        stopovers=[_transform_stopover(place, times) for place in [from_place] + intermediate_places + [to_place]],
+        polyline=geometry if geometry else None
+    )
+
+
+_otp_to_fptf_modes = {
+    'WALK': fptf.Mode.WALKING,
+    'BUS': fptf.Mode.BUS,
+    'RAIL': fptf.Mode.TRAIN,
+    'TRAM': fptf.Mode.TRAIN,
+    'SUBWAY': fptf.Mode.TRAIN,
+    'TRANSIT': fptf.Mode.TRAIN,
+    'BICYCLE': fptf.Mode.BICYCLE,
+    'CAR': fptf.Mode.CAR
+}
 
-    def transform_to_arrival(self):
-        return datetime.datetime.fromtimestamp(self.arrival_time / 1000)
 
-    def transform_to_stopover(self):
-        return fptf.Stopover(
-            stop=self.transform_to_stop_station(),
-            arrival=self.transform_to_arrival(),
-            departure=self.transform_to_departure()
+def transform_mode(mode):
+    return _otp_to_fptf_modes.get(mode, '')
+
+
+def _get_time(times: dict, ms: int) -> datetime.datetime:
+    """
+    Convert a millisecond timestamp to a datetime, reusing earlier conversions of the same timestamp
+    :param times: the datetimes of the timestamps converted so far
+    :param ms: the timestamp in milliseconds
+    :return: the datetime
+    """
+    t = times.get(ms)
+    if t is None:
+        t = datetime.datetime.fromtimestamp(ms / 1000)
+        times[ms] = t
+    return t
+
+
+def _transform_station(place) -> fptf.Station:
+    stop = place.get('stop')
+    return fptf.Station(
+        id=stop['gtfsId'] if stop else '',
+        name=place['name'],
+        location=fptf.Location(
+            latitude=place['lat'],
+            longitude=place['lon']
         )
+    )
 
 
-class OtpStop:
-    def __init__(self, stop):
-        self.gtfs_id = stop['gtfsId']
-
-
-class OtpRoute:
-    def __init__(self, route):
-        self.gtfs_id = route['gtfsId']
-        self.long_name = route['longName']
-        self.short_name = route['shortName']
-
-    def transform(self, mode: fptf.Mode):
-        return fptf.Line(
-            id=self.gtfs_id,
-            name=self.long_name,
-            mode=mode,
-            routes=None,
-            operator=None
-        )
+def _transform_stopover(place, times: dict) -> fptf.Stopover:
+    return fptf.Stopover(
+        stop=_transform_station(place),
+        arrival=_get_time(times, place['arrivalTime']),
+        departure=_get_time(times, place['departureTime'])
+    )
 
 
 if __name__ == "__main__":
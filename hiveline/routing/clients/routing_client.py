@@ -1,5 +1,6 @@
 import datetime
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 
 from hiveline.models import fptf
 
@@ -19,3 +20,15 @@ class RoutingClient(ABC):
         :return: a list of fptf journey
         """
         pass
+
+    def get_journeys_batch(self, queries: list[tuple[float, float, float, float, datetime.datetime, list[fptf.Mode]]],
+                           max_workers=16) -> list[list[fptf.Journey] | None]:
+        """
+        Get routes for many independent queries. Routing is mostly waiting for the router, so the queries are sent from
+        a thread pool and overlap each other.
+        :param queries: the (from_lat, from_lon, to_lat, to_lon, departure, modes) arguments of each get_journeys call
+        :param max_workers: the maximum number of queries in flight
+        :return: the result of get_journeys for each query, in the same order as the queries
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda query: self.get_journeys(*query), queries))
@@ -1,11 +1,22 @@
+from concurrent.futures import ThreadPoolExecutor
+
 from hiveline.mongo.db import get_database
 
+result_collections = ["route-options", "route-results", "route-calculation-jobs"]
+
+
+def __drop_collection_results(db, collection, sim_id):
+    coll = db[collection]
+    coll.create_index("sim-id")  # no-op if the index exists, lets the delete use an index scan
+    coll.delete_many({"sim-id": sim_id})
+
 
 def drop_results(sim_id):
     db = get_database()
-    db["route-options"].delete_many({"sim-id": sim_id})
-    db["route-results"].delete_many({"sim-id": sim_id})
-    db["route-calculation-jobs"].delete_many({"sim-id": sim_id})
+
+    # the collections are independent, so the deletes can run concurrently
+    with ThreadPoolExecutor(max_workers=len(result_collections)) as executor:
+        list(executor.map(lambda collection: __drop_collection_results(db, collection, sim_id), result_collections))
 
 
 if __name__ == "__main__":
@@ -1,145 +1,254 @@
-import os.path
+import csv
+import io
+import json
+import os
 import shutil
-
-import pandas as pd
+import threading
 import zipfile
 
+import numpy as np
+
+verified_lock = threading.Lock()  # the GTFS files of the providers are fixed concurrently
+
+# the fixed archives are only read by the graph build, so fast compression beats small files (stop_times.txt can be
+# hundreds of MB)
+zip_compresslevel = 1
+
+transfer_id_columns = frozenset({"from_stop_id", "to_stop_id", "from_trip_id", "to_trip_id", "from_route_id",
+                                 "to_route_id"})
+
+
+def _read_columns(gtfs_zip: zipfile.ZipFile, name: str):
+    """
+    Read only the header of a file in a GTFS zip file
+    :param gtfs_zip: The opened GTFS zip file
+    :param name: The name of the file
+    :return: The column names
+    """
+    import pandas as pd  # only needed when a downloaded feed is fixed, so routing runs don't import it
+
+    with gtfs_zip.open(name) as f:
+        return pd.read_csv(f, nrows=0, engine="c").columns
+
 
-def unzip_gtfs(zip_path, unzip_path):
+def _read_csv_head(gtfs_zip: zipfile.ZipFile, name: str):
     """
-    Unzip a GTFS zip file to a folder
-    :param zip_path: The path to the zip file
-    :param unzip_path: The path to the folder to unzip to
-    :return:
+    Read only the header and the first row of a file in a GTFS zip file
+    :param gtfs_zip: The opened GTFS zip file
+    :param name: The name of the file
+    :return: The data frame with at most one row
     """
-    if os.path.exists(unzip_path):  # delete existing folder
-        shutil.rmtree(unzip_path)
+    import pandas as pd
 
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        zip_ref.extractall(unzip_path)
+    with gtfs_zip.open(name) as f:
+        return pd.read_csv(f, nrows=1, dtype=str, engine="c")
 
 
-def zip_gtfs(unzip_path, zip_path):
+def _read_csv(gtfs_zip: zipfile.ZipFile, name: str, columns: list[str] = None):
     """
-    Zip a GTFS folder to a zip file
-    :param unzip_path: The path to the folder to zip
-    :param zip_path: The path to the zip file
-    :return:
+    Read a file in a GTFS zip file as strings. The pyarrow CSV reader parses the file on multiple threads and keeps the
+    strings arrow-backed, which is also faster to hash for the id checks. Every column is read as a string up front
+    (pandas' pyarrow engine would infer numbers first and drop leading zeros of ids), empty values are missing.
+    :param gtfs_zip: The opened GTFS zip file
+    :param name: The name of the file
+    :param columns: (optional) The columns to read, defaults to all columns
+    :return: The data frame
     """
-    if os.path.exists(zip_path):  # delete existing zip file
-        os.remove(zip_path)
+    import pandas as pd
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
 
-    # Length of path to remove for correct relative paths
-    len_dir_path = len(os.path.dirname(unzip_path))
+    if columns is None:
+        columns = list(_read_columns(gtfs_zip, name))
 
-    # Create a ZipFile object in write mode
-    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        # Walk through the directory
-        for root, dirs, files in os.walk(unzip_path):
-            print(root, dirs, files)
-            for file in files:
-                # Form the full file path
-                file_path = os.path.join(root, file)
-                # Add file to the zip file
-                zipf.write(file_path, file)
+    convert_options = pa_csv.ConvertOptions(column_types={column: pa.string() for column in columns},
+                                            include_columns=columns, strings_can_be_null=True, null_values=[""])
 
+    with gtfs_zip.open(name) as f:
+        return pa_csv.read_csv(f, convert_options=convert_options).to_pandas(types_mapper=pd.ArrowDtype)
 
-def fix_transfer_stops(gtfs_path):
+
+def fix_transfer_stops(gtfs_zip: zipfile.ZipFile):
     """
     Remove transfers that reference stops, routes or trips that don't exist
-    :param gtfs_path: The path to the GTFS folder
-    :return: True if the GTFS was changed, False if it was not
+    :param gtfs_zip: The opened GTFS zip file
+    :return: The new content of transfers.txt if the GTFS was changed, None if it was not
     """
-    stops_file = gtfs_path + "/stops.txt"
-    trips_file = gtfs_path + "/trips.txt"
-    routes_file = gtfs_path + "/routes.txt"
-    transfers_file = gtfs_path + "/transfers.txt"
+    names = set(gtfs_zip.namelist())
+    if not {"stops.txt", "trips.txt", "routes.txt", "transfers.txt"}.issubset(names):
+        return None  # invalid, nothing changed
+
+    # feeds without transfers are common (e.g. bus-only feeds), they don't need the other files at all
+    if gtfs_zip.getinfo("transfers.txt").file_size == 0 or _read_csv_head(gtfs_zip, "transfers.txt").empty:
+        return None  # no transfers, nothing changed
+
+    # only the id columns are needed for the checks, so the other columns are not parsed
+    transfer_columns = [column for column in _read_columns(gtfs_zip, "transfers.txt") if column in transfer_id_columns]
+    transfers_df = _read_csv(gtfs_zip, "transfers.txt", transfer_columns)
+
+    # hash each set of referenced ids once, instead of once per filtered column. trips and routes are only read if
+    # the transfers reference them.
+    stop_ids = frozenset(_read_csv(gtfs_zip, "stops.txt", ["stop_id"])["stop_id"])
+    trip_ids = frozenset()
+    route_ids = frozenset()
+    if not {"from_trip_id", "to_trip_id"}.isdisjoint(transfer_columns):
+        trip_ids = frozenset(_read_csv(gtfs_zip, "trips.txt", ["trip_id"])["trip_id"])
+    if not {"from_route_id", "to_route_id"}.isdisjoint(transfer_columns):
+        route_ids = frozenset(_read_csv(gtfs_zip, "routes.txt", ["route_id"])["route_id"])
+
+    # every check is and-ed into one mask in place, so the transfers are only sliced once and no intermediate masks
+    # are stacked
+    keep = np.ones(len(transfers_df), dtype=bool)
 
-    if not os.path.exists(transfers_file) or not os.path.exists(stops_file) or not os.path.exists(trips_file) \
-            or not os.path.exists(routes_file):
-        return False  # invalid, nothing changed
+    # remove transfers that reference stops that don't exist
+    keep &= transfers_df["from_stop_id"].isin(stop_ids).to_numpy(dtype=bool)
+    keep &= transfers_df["to_stop_id"].isin(stop_ids).to_numpy(dtype=bool)
 
-    stops_df = pd.read_csv(stops_file, dtype=str)
-    trips_df = pd.read_csv(trips_file, dtype=str)
-    routes_df = pd.read_csv(routes_file, dtype=str)
-    transfers_df = pd.read_csv(transfers_file, dtype=str)
+    # remove transfers that reference trips or routes that don't exist (only if the id is not empty)
+    for (column, ids) in (("from_trip_id", trip_ids), ("to_trip_id", trip_ids), ("from_route_id", route_ids),
+                          ("to_route_id", route_ids)):
+        if column in transfers_df.columns:
+            keep &= (transfers_df[column].isin(ids) | transfers_df[column].isnull()).to_numpy(dtype=bool)
 
-    num_transfers = len(transfers_df)
+    if keep.all():
+        return None  # nothing changed
 
-    # remove transfers that reference stops that don't exist
-    transfers_df = transfers_df[transfers_df["from_stop_id"].isin(stops_df["stop_id"])]
-    transfers_df = transfers_df[transfers_df["to_stop_id"].isin(stops_df["stop_id"])]
-
-    # remove transfers that reference trips that don't exist (only if the trip id is not empty)
-    if "from_trip_id" in transfers_df.columns:
-        transfers_df = transfers_df[
-            transfers_df["from_trip_id"].isin(trips_df["trip_id"]) | transfers_df["from_trip_id"].isnull()]
-    if "to_trip_id" in transfers_df.columns:
-        transfers_df = transfers_df[
-            transfers_df["to_trip_id"].isin(trips_df["trip_id"]) | transfers_df["to_trip_id"].isnull()]
-
-    # remove transfers that reference routes that don't exist (only if the route id is not empty)
-    if "from_route_id" in transfers_df.columns:
-        transfers_df = transfers_df[
-            transfers_df["from_route_id"].isin(routes_df["route_id"]) | transfers_df["from_route_id"].isnull()]
-    if "to_route_id" in transfers_df.columns:
-        transfers_df = transfers_df[
-            transfers_df["to_route_id"].isin(routes_df["route_id"]) | transfers_df["to_route_id"].isnull()]
-
-    if len(transfers_df) == num_transfers:
-        return False  # nothing changed
-
-    transfers_df.to_csv(transfers_file, index=False)
+    # the whole file is only parsed when it has to be written back
+    transfers_df = _read_csv(gtfs_zip, "transfers.txt").loc[keep]
 
-    return True
+    return transfers_df.to_csv(index=False).encode()
 
 
-def fix_authorities(gtfs_path):
+def fix_authorities(gtfs_zip: zipfile.ZipFile):
     """
     If a value in the column "agency_url" is missing from the agencies.txt file, add it
-    :param gtfs_path: The path to the GTFS folder
+    :param gtfs_zip: The opened GTFS zip file
+    :return: The new content of agency.txt if the GTFS was changed, None if it was not
+    """
+    if "agency.txt" not in gtfs_zip.namelist():
+        return None
+
+    # agency.txt only has a few rows, so it is edited with the csv module instead of loading it into pandas
+    with gtfs_zip.open("agency.txt") as f:
+        rows = [row for row in csv.reader(io.TextIOWrapper(f, encoding="utf-8-sig", newline="")) if row]
+
+    if len(rows) == 0:
+        return None  # invalid, nothing changed
+
+    header = rows[0]
+
+    # add agency_url column if it doesn't exist
+    if "agency_url" not in header:
+        header.append("agency_url")
+        for row in rows[1:]:
+            row += [""] * (len(header) - 1 - len(row)) + ["-"]
+    else:
+        # add "-" to each row if agency_url is empty string
+        url_index = header.index("agency_url")
+        has_changed = False
+
+        for row in rows[1:]:
+            if len(row) <= url_index or row[url_index] == "":
+                row += [""] * (url_index + 1 - len(row))
+                row[url_index] = "-"
+                has_changed = True
+
+        if not has_changed:
+            return None  # nothing changed
+
+    output = io.StringIO()
+    csv.writer(output, lineterminator="\n").writerows(rows)
+    return output.getvalue().encode()
+
+
+def fix_gtfs(gtfs_path):
+    """
+    Fix a GTFS zip file. It will remove any invalid data. For example if there are transfers that reference stops that
+    don't exist, they will be removed. Only the fixed files are rewritten, all other files are copied as they are.
+    Archives that were already verified (see _get_fingerprint) are skipped without opening them.
+    :param gtfs_path: The path to the GTFS zip file
     :return: True if the GTFS was changed, False if it was not
     """
-    agencies_file = gtfs_path + "/agency.txt"
+    verified_path = os.path.join(os.path.dirname(gtfs_path), ".gtfs_ok.json")
+
+    with verified_lock:
+        verified = _read_verified(verified_path)
 
-    if not os.path.exists(agencies_file):
+    if _get_fingerprint(gtfs_path) in verified:
+        print("GTFS already verified: " + gtfs_path)
         return False
 
-    agencies_df = pd.read_csv(agencies_file, dtype=str)
+    has_changed = _fix_gtfs_archive(gtfs_path)
 
-    # add agency_url column if it doesn't exist
-    if "agency_url" not in agencies_df.columns:
-        agencies_df["agency_url"] = "-"
+    with verified_lock:
+        verified = _read_verified(verified_path)
+        verified.add(_get_fingerprint(gtfs_path))
 
-    # add "-" to each row if agency_url is empty string
-    agencies_df["agency_url"] = agencies_df["agency_url"].fillna("-")
+        with open(verified_path, "w") as f:
+            json.dump(sorted(verified), f)
 
-    agencies_df.to_csv(agencies_file, index=False)
+    return has_changed
 
-    return True
+
+def _get_fingerprint(gtfs_path):
+    """
+    Get the fingerprint of a file. It only needs a stat call and changes whenever the file is rewritten. Hard links
+    of the same file (see the download deduplication) share it.
+    :param gtfs_path: The path to the file
+    :return: The fingerprint
+    """
+    stat = os.stat(gtfs_path)
+    return ":".join([str(stat.st_dev), str(stat.st_ino), str(stat.st_size), str(stat.st_mtime_ns)])
 
 
-def fix_gtfs(gtfs_path, temp_dir):
+def _read_verified(verified_path):
     """
-    Fix a GTFS zip file. This will unzip the file, fix it, and re-zip it. It will remove any invalid data. For example
-    if there are transfers that reference stops that don't exist, they will be removed.
-    :param gtfs_path: The path to the GTFS zip file
-    :param temp_dir: The path to a temporary directory to use
-    :return:
+    Read the fingerprints of the verified GTFS files
+    :param verified_path: The path to the verified file list
+    :return: The set of fingerprints
     """
-    print("Fixing GTFS: " + gtfs_path)
+    if not os.path.isfile(verified_path):
+        return set()
 
-    unzip_gtfs(gtfs_path, temp_dir)
+    with open(verified_path, "r") as f:
+        return set(json.load(f))
 
-    has_changed = fix_transfer_stops(temp_dir)
-    has_changed = fix_authorities(temp_dir) or has_changed
 
-    if not has_changed:
-        shutil.rmtree(temp_dir)
-        print("GTFS was not changed")
-        return False  # nothing changed, skipping re-zip
+def _fix_gtfs_archive(gtfs_path):
+    """
+    Fix a GTFS zip file (see fix_gtfs)
+    :param gtfs_path: The path to the GTFS zip file
+    :return: True if the GTFS was changed, False if it was not
+    """
+    print("Fixing GTFS: " + gtfs_path)
 
-    zip_gtfs(temp_dir, gtfs_path)
+    with zipfile.ZipFile(gtfs_path, 'r') as gtfs_zip:
+        fixed_files = {
+            "transfers.txt": fix_transfer_stops(gtfs_zip),
+            "agency.txt": fix_authorities(gtfs_zip)
+        }
+        fixed_files = {name: data for (name, data) in fixed_files.items() if data is not None}
+
+        if len(fixed_files) == 0:
+            print("GTFS was not changed")
+            return False  # nothing changed, skipping re-zip
+
+        # write the fixed archive next to the original, so it can replace it in one step
+        temp_path = gtfs_path + ".tmp"
+        with zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=zip_compresslevel) as fixed_zip:
+            for info in gtfs_zip.infolist():
+                if info.filename in fixed_files:
+                    continue
+                # the members are streamed, so large ones (e.g. stop_times.txt) are never held in memory. they are
+                # opened by name, so they are compressed with the archive's (faster) level.
+                with gtfs_zip.open(info) as src, \
+                        fixed_zip.open(info.filename, "w", force_zip64=info.file_size >= zipfile.ZIP64_LIMIT) as dst:
+                    shutil.copyfileobj(src, dst, 1 << 20)
+
+            for (name, data) in fixed_files.items():
+                fixed_zip.writestr(name, data)
+
+    os.replace(temp_path, gtfs_path)
 
-    shutil.rmtree(temp_dir)
     print("GTFS was changed")
+    return True
@@ -1,12 +1,26 @@
 import datetime
 import hashlib
+import json
+import mmap
 import os
-import urllib.request
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+import requests
 
 from hiveline.routing import gtfs_consistency
 from hiveline.routing.servers.routing_server import RoutingServerConfig
 from hiveline.routing.util import ensure_directory
 
+download_timeout = 60
+download_chunk_size = 1 << 20
+min_download_part_size = 8 << 20
+
+content_hashes_lock = threading.Lock()  # the GTFS providers are downloaded concurrently
+
 
 def build_resources(data_dir: str, place, sim_date: datetime.date) -> RoutingServerConfig:
     """
@@ -46,22 +60,27 @@ def __get_closest_link(link_list, target_date: datetime.date, ignore_future: boo
     if link_list is None or len(link_list) == 0:
         return None
 
-    min_dist = None
-    min_dist_index = None
+    dates = np.array([link["date"].date() for link in link_list], dtype="datetime64[D]")
+    target = np.datetime64(target_date, "D")
 
-    for i in range(len(link_list)):
-        link = link_list[i]
-        if ignore_future and link["date"].date() > target_date:
-            continue
-        dist = abs(link["date"].date() - target_date)
-        if min_dist is None or dist < min_dist:
-            min_dist = dist
-            min_dist_index = i
+    indices = np.arange(len(dates))
+    if ignore_future:
+        indices = indices[dates <= target]
+        if len(indices) == 0:
+            return None
+
+    # argmin returns the first of equally close links, like the strict comparison did before
+    return link_list[indices[np.abs(dates[indices] - target).argmin()]]
 
-    if min_dist is None:
-        return None
 
-    return link_list[min_dist_index]
+@lru_cache(maxsize=4096)
+def _link_slug(link: str) -> str:
+    """
+    Get the file name slug of a download link
+    :param link: The link
+    :return: The hex digest of the link
+    """
+    return hashlib.blake2b(link.encode(), digest_size=16).hexdigest()
 
 
 def __ensure_data_downloaded(data_dir: str, link_object, file_name_extension: str):
@@ -74,28 +93,136 @@ def __ensure_data_downloaded(data_dir: str, link_object, file_name_extension: st
     """
     if file_name_extension[0] != ".":
         file_name_extension = "." + file_name_extension
-    if data_dir.endswith("/"):
-        data_dir = data_dir[:-1]
 
     if link_object is None:
         return None
 
     link = link_object["link"]
-    link_hash = hashlib.sha3_256(link.encode()).hexdigest()
 
     ensure_directory(data_dir)
 
-    target_file_name = data_dir + "/" + link_hash + file_name_extension
+    target_file_name = os.path.join(data_dir, _link_slug(link) + file_name_extension)
     if os.path.isfile(target_file_name):
         return target_file_name, False
 
+    # files downloaded before the slug changed are named by the SHA3-256 hash of the link, reuse them
+    legacy_file_name = os.path.join(data_dir, hashlib.sha3_256(link.encode()).hexdigest() + file_name_extension)
+    if os.path.isfile(legacy_file_name):
+        os.replace(legacy_file_name, target_file_name)
+        return target_file_name, False
+
     print("Downloading " + link)
 
-    urllib.request.urlretrieve(link, target_file_name)
+    __download(link, target_file_name)
+    __deduplicate_download(data_dir, target_file_name)
 
     return target_file_name, True
 
 
+def __hash_file(file_name: str) -> str:
+    """
+    Hashes the content of a file. The file is memory-mapped, so it is not copied into a buffer first.
+    :param file_name: The file name
+    :return: The hex digest of the content
+    """
+    content_hash = hashlib.blake2b(digest_size=32)
+
+    with open(file_name, "rb") as f:
+        if os.fstat(f.fileno()).st_size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                content_hash.update(mm)
+
+    return content_hash.hexdigest()
+
+
+def __deduplicate_download(data_dir: str, file_name: str):
+    """
+    Deduplicates a downloaded file by its content. The content hashes of the downloaded files are kept in
+    content_hashes.json in the data directory. If a file with the same content was downloaded before (e.g. the same
+    OSM extract for two places), the new file is replaced by a hard link to it.
+    :param data_dir: The directory where the data is stored
+    :param file_name: The file name of the downloaded file
+    """
+    content_hash = __hash_file(file_name)
+    hashes_file_name = os.path.join(data_dir, "content_hashes.json")
+
+    with content_hashes_lock:
+        content_hashes = {}
+        if os.path.isfile(hashes_file_name):
+            with open(hashes_file_name, "r") as f:
+                content_hashes = json.load(f)
+
+        canonical_file_name = os.path.join(data_dir, content_hashes.get(content_hash, os.path.basename(file_name)))
+        if canonical_file_name != file_name and os.path.isfile(canonical_file_name):
+            print("Deduplicating " + file_name + " with " + canonical_file_name)
+            os.link(canonical_file_name, file_name + ".link")
+            os.replace(file_name + ".link", file_name)
+            return
+
+        content_hashes[content_hash] = os.path.basename(file_name)
+
+        with open(hashes_file_name, "w") as f:
+            json.dump(content_hashes, f)
+
+
+def __download(link: str, target_file_name: str, parts: int = 8):
+    """
+    Downloads a file. If the server supports range requests and the file is large enough, it is downloaded in parallel
+    parts, otherwise as a single stream. The data is written to a ".part" file first, which is only renamed to the
+    target file name once the download is complete, so an interrupted download is never mistaken for a finished one.
+    :param link: The link to download
+    :param target_file_name: The file name to write to
+    :param parts: The number of parallel range requests
+    """
+    part_file_name = target_file_name + ".part"
+
+    head = requests.head(link, allow_redirects=True, timeout=download_timeout)
+    size = int(head.headers.get("Content-Length", 0))
+
+    if head.ok and head.headers.get("Accept-Ranges") == "bytes" and size >= parts * min_download_part_size:
+        part_size = -(-size // parts)  # ceil
+        ranges = [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+
+        fd = os.open(part_file_name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+                list(executor.map(lambda r: __download_range(head.url, fd, r[0], r[1]), ranges))
+        finally:
+            os.close(fd)
+    else:
+        with requests.get(link, stream=True, timeout=download_timeout) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            with open(part_file_name, "wb") as f:
+                shutil.copyfileobj(response.raw, f, length=download_chunk_size)
+
+    os.replace(part_file_name, target_file_name)
+
+
+def __download_range(link: str, fd: int, start: int, end: int):
+    """
+    Downloads a byte range of a file and writes it to the same position in an open file.
+    :param link: The link to download
+    :param fd: The file descriptor to write to
+    :param start: The first byte of the range
+    :param end: The last byte of the range (inclusive)
+    """
+    headers = {"Range": "bytes=" + str(start) + "-" + str(end)}
+    with requests.get(link, headers=headers, stream=True, timeout=download_timeout) as response:
+        response.raise_for_status()
+        if response.status_code != 206:
+            raise Exception("Server did not return the requested range of " + link)
+
+        offset = start
+        for chunk in response.raw.stream(download_chunk_size, decode_content=False):
+            os.pwrite(fd, chunk, offset)
+            offset += len(chunk)
+
+    if offset != end + 1:
+        raise Exception("Incomplete download of " + link)
+
+
 def __ensure_closest_pbf_downloaded(data_dir, place, sim_date):
     """
     Ensures that the closest OSM file to a target date is downloaded.
@@ -105,8 +232,6 @@ def __ensure_closest_pbf_downloaded(data_dir, place, sim_date):
     :return: file: The file name of the downloaded file, source: The source of the file, date: The date of the file
              None if no OSM file was found
     """
-    if data_dir.endswith("/"):
-        data_dir = data_dir[:-1]
 
     closest_osm_link = __get_closest_link(place["osm"], sim_date)
     if closest_osm_link is None:
@@ -115,7 +240,7 @@ def __ensure_closest_pbf_downloaded(data_dir, place, sim_date):
 
     print(closest_osm_link)
 
-    closest_osm_file, _ = __ensure_data_downloaded(data_dir + "/osm", closest_osm_link, ".pbf")
+    closest_osm_file, _ = __ensure_data_downloaded(os.path.join(data_dir, "osm"), closest_osm_link, ".pbf")
     return {
         "file": closest_osm_file,
         "source": closest_osm_link["link"],
@@ -132,25 +257,43 @@ def __ensure_closest_gtfs_downloaded(data_dir, place, sim_date):
     :return: list of objects with fields:
              file: The file name of the downloaded file, source: The source of the file, date: The date of the file
     """
-    links = []
+    providers = list(place["gtfs"].items())
+    if len(providers) == 0:
+        return []
 
-    for provider, link_list in place["gtfs"].items():
-        closest_gtfs_link = __get_closest_link(link_list, sim_date, True)
-        if closest_gtfs_link is None:
-            continue
+    # the providers are independent and mostly wait for their downloads, so they are handled concurrently
+    with ThreadPoolExecutor(max_workers=len(providers)) as executor:
+        links = list(executor.map(lambda provider: __ensure_provider_gtfs_downloaded(data_dir, provider[0], provider[1],
+                                                                                     sim_date), providers))
 
-        print(closest_gtfs_link)
+    return [link for link in links if link is not None]
 
-        closest_gtfs_file, downloaded = __ensure_data_downloaded(data_dir + "/gtfs", closest_gtfs_link, ".gtfs.zip")
 
-        if downloaded:
-            gtfs_consistency.fix_gtfs(closest_gtfs_file, data_dir + "/gtfs/temp")  # fix inconsistencies
+def __ensure_provider_gtfs_downloaded(data_dir, provider, link_list, sim_date):
+    """
+    Ensures that the closest GTFS file of one provider to a target date is downloaded.
+    :param data_dir: The directory where the data should be stored
+    :param provider: The name of the provider
+    :param link_list: The GTFS links of the provider
+    :param sim_date: The target date
+    :return: file: The file name of the downloaded file, source: The source of the file, date: The date of the file,
+             provider: The provider. None if no GTFS file was found
+    """
+    closest_gtfs_link = __get_closest_link(link_list, sim_date, True)
+    if closest_gtfs_link is None:
+        return None
+
+    print(closest_gtfs_link)
+
+    closest_gtfs_file, downloaded = __ensure_data_downloaded(os.path.join(data_dir, "gtfs"), closest_gtfs_link,
+                                                             ".gtfs.zip")
 
-        links.append({
-            "file": closest_gtfs_file,
-            "source": closest_gtfs_link["link"],
-            "date": closest_gtfs_link["date"],
-            "provider": provider
-        })
+    if downloaded:
+        gtfs_consistency.fix_gtfs(closest_gtfs_file)  # fix inconsistencies
 
-    return links
+    return {
+        "file": closest_gtfs_file,
+        "source": closest_gtfs_link["link"],
+        "date": closest_gtfs_link["date"],
+        "provider": provider
+    }
@@ -2,10 +2,14 @@ import datetime
 import json
 import os
 import platform
+import shutil
 import signal
 import subprocess
 import threading
 import urllib.request
+from pathlib import Path
+
+import orjson
 
 from hiveline.routing.servers.routing_server import RoutingServer, RoutingServerConfig
 from hiveline.routing.util import ensure_directory, wait_for_line, iterate_output
@@ -19,6 +23,7 @@ class OpenTripPlannerRoutingServer(RoutingServer):
         self.memory_gb = memory_gb
         self.api_timeout = api_timeout
         self.process = None  # instantiated when server is started
+        self.graph_link: str | None = None  # the graph.obj link in the bin directory while the server is running
         self.debug_thread: threading.Thread | None = None
         self.err_thread: threading.Thread | None = None
         self.debug = debug
@@ -54,7 +59,7 @@ class OpenTripPlannerRoutingServer(RoutingServer):
         # move to data directory
         _ensure_graphs_directory(graphs_path)
 
-        os.rename(bin_path + "/graph.obj", graph_file)
+        shutil.move(bin_path + "/graph.obj", graph_file)  # only copies if the graphs are on another file system
 
         return [graph_file]
 
@@ -72,19 +77,11 @@ class OpenTripPlannerRoutingServer(RoutingServer):
             print("Graph file not found")
             return None
 
-        print("Moving graph file...")
-        os.rename(graph_file, bin_path + "/graph.obj")
+        _use_graph_file(bin_path, graph_file)
+        self.graph_link = bin_path + "/graph.obj"
 
         _use_run_config(bin_path, self.api_timeout)
 
-        # store graph file name prefix
-        graph_file_prefix = os.path.basename(graph_file).rstrip("-graph.obj")
-
-        with open(bin_path + "/graph-source.json", "w", encoding="utf-8") as f:
-            json.dump({
-                "source": graph_file_prefix
-            }, f)
-
         print("Starting server...")
 
         args = ["java", "-Xmx" + str(self.memory_gb) + "G", "-jar", bin_path + "/" + self.otp_file_name, "--load",
@@ -146,6 +143,10 @@ class OpenTripPlannerRoutingServer(RoutingServer):
             self.err_thread.join()
             self.err_thread = None
 
+        if self.graph_link is not None and os.path.islink(self.graph_link):
+            os.unlink(self.graph_link)
+        self.graph_link = None
+
     def get_meta(self):
         return {
             "name": "OpenTripPlanner",
@@ -182,9 +183,9 @@ def _use_build_config(bin_path: str, osm_files: list[str], gtfs_files: list[str]
     :param target_date: The target date (build process will limit transit service period to +/- 1 year)
     :return:
     """
-    # convert to absolute paths
-    osm_files = ["file:///" + os.path.abspath(f).replace("\\", "/") for f in osm_files]
-    gtfs_files = ["file:///" + os.path.abspath(f).replace("\\", "/") for f in gtfs_files]
+    # convert to absolute file URIs (as_uri also handles Windows separators and escaping)
+    osm_files = [Path(f).resolve().as_uri() for f in osm_files]
+    gtfs_files = [Path(f).resolve().as_uri() for f in gtfs_files]
 
     # limit transit service period to +/- 1 year
     min_date = (target_date - datetime.timedelta(days=365)).strftime("%Y-%m-%d")
@@ -202,8 +203,8 @@ def _use_build_config(bin_path: str, osm_files: list[str], gtfs_files: list[str]
 
     config_file_name = bin_path + "/build-config.json"
 
-    with open(config_file_name, "w", encoding="utf-8") as f:
-        json.dump(build_config, f)
+    with open(config_file_name, "wb") as f:
+        f.write(orjson.dumps(build_config))
 
 
 def _use_run_config(bin_path, api_processing_timeout=20):
@@ -219,8 +220,8 @@ def _use_run_config(bin_path, api_processing_timeout=20):
         }
     }
 
-    with open(bin_path + "/router-config.json", "w") as f:
-        json.dump(run_config, f)
+    with open(bin_path + "/router-config.json", "wb") as f:
+        f.write(orjson.dumps(run_config))
 
 
 def _ensure_graphs_directory(graphs_path):
@@ -231,14 +232,46 @@ def _ensure_graphs_directory(graphs_path):
     ensure_directory(graphs_path)
 
 
+def _use_graph_file(bin_path, graph_file):
+    """
+    Makes the graph file available as graph.obj in the bin directory. It is linked instead of moved, so the (multi-GB)
+    graph is never moved around. If symbolic links are not available (e.g. on Windows without the privilege), the graph
+    file is moved and its source is stored in graph-source.json, so it can be moved back later.
+    :param bin_path: The bin directory
+    :param graph_file: The graph file
+    :return:
+    """
+    try:
+        os.symlink(os.path.abspath(graph_file), bin_path + "/graph.obj")
+        return
+    except OSError:
+        pass
+
+    print("Moving graph file...")
+    os.rename(graph_file, bin_path + "/graph.obj")
+
+    # store graph file name prefix
+    graph_file_prefix = os.path.basename(graph_file).removesuffix("-graph.obj")
+
+    with open(bin_path + "/graph-source.json", "w", encoding="utf-8") as f:
+        json.dump({
+            "source": graph_file_prefix
+        }, f)
+
+
 def _clean_up_graph_file(bin_path, graphs_path):
     """
-    Cleans up the graph file. If the routing algorithm did not move the graph file back, it will just stay in the bin
-    directory, so we move it back in this case. If we can't figure out where it came from, it will be deleted.
+    Cleans up the graph file. A linked graph file is just unlinked. If the routing algorithm did not move the graph
+    file back, it will just stay in the bin directory, so we move it back in this case. If we can't figure out where
+    it came from, it will be deleted.
     :return:
     """
     _ensure_graphs_directory(bin_path)
 
+    if os.path.islink(bin_path + "/graph.obj"):
+        os.unlink(bin_path + "/graph.obj")
+        return
+
     if not os.path.isfile(bin_path + "/graph.obj"):
         return
 
@@ -45,14 +45,13 @@ def route_virtual_commuters(sim_id, profile="opentripplanner", data_dir="./cache
                                           num_threads, reset_jobs, reset_failed, timeout)
         return
 
-    base_path = os.getenv("PROJECT_PATH")
-    if base_path.endswith("/"):
-        base_path = base_path[:-1]
+    base_path = Path(os.getenv("PROJECT_PATH"))
 
-    data_dir = Path.joinpath(Path(base_path), data_dir).__str__()
+    data_dir = str(base_path / data_dir)
 
-    args = ["python", base_path + "/hiveline/routing/vc_router.py", str(sim_id), "--profile", profile, "--data-dir",
-            data_dir, "--memory", str(memory_gb), "--num-threads", str(num_threads), "--timeout", str(timeout)]
+    args = ["python", str(base_path / "hiveline" / "routing" / "vc_router.py"), str(sim_id), "--profile", profile,
+            "--data-dir", data_dir, "--memory", str(memory_gb), "--num-threads", str(num_threads), "--timeout",
+            str(timeout)]
 
     if not use_delays:
         args.append("--no-delays")
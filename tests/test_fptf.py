@@ -0,0 +1,46 @@
+import pickle
+
+import pytest
+
+from hiveline.models import fptf
+
+leg_data = {
+    "origin": {"type": "location", "latitude": 51.44, "longitude": 5.47},
+    "destination": {"type": "location", "latitude": 51.45, "longitude": 5.48},
+    "departure": "2023-05-01T08:00:00+02:00",
+    "arrival": "2023-05-01T08:10:00+02:00",
+    "mode": "bus",
+    "polyline": "_p~iF~ps|U_ulLnnqC",
+}
+
+
+def _is_parsed(leg, name):
+    try:
+        object.__getattribute__(leg, name)
+        return True
+    except AttributeError:
+        return False
+
+
+def test_lazy_leg_pickle_keeps_unread_fields_unparsed():
+    leg = fptf.leg_from_dict_lazy(leg_data)
+    assert leg.mode == fptf.Mode.BUS
+
+    restored = pickle.loads(pickle.dumps(leg))
+
+    for name in fptf._leg_field_parsers:
+        if name != "mode":
+            assert not _is_parsed(leg, name)
+            assert not _is_parsed(restored, name)
+
+    assert _is_parsed(restored, "mode")
+    assert restored.mode == fptf.Mode.BUS
+
+
+def test_lazy_leg_pickle_parses_fields_after_restore():
+    restored = pickle.loads(pickle.dumps(fptf.leg_from_dict_lazy(leg_data)))
+
+    assert isinstance(restored, fptf.LazyLeg)
+    assert restored.origin.latitude == pytest.approx(51.44)
+    assert restored.arrival == fptf.read_datetime(leg_data["arrival"])
+    assert restored.polyline == leg_data["polyline"]
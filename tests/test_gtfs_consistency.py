@@ -0,0 +1,48 @@
+import io
+import zipfile
+
+import pytest
+
+from hiveline.routing import gtfs_consistency
+
+pytest.importorskip("pyarrow")
+
+
+def _gtfs_zip(files: dict[str, str]) -> zipfile.ZipFile:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as gtfs_zip:
+        for (name, content) in files.items():
+            gtfs_zip.writestr(name, content)
+
+    return zipfile.ZipFile(buffer)
+
+
+def test_fix_transfer_stops_keeps_zero_padded_ids():
+    gtfs_zip = _gtfs_zip({
+        "stops.txt": "stop_id,stop_name\n0012,A\n0034,B\n1,C\n",
+        "trips.txt": "trip_id,route_id\n007,01\n",
+        "routes.txt": "route_id\n01\n",
+        "transfers.txt": "from_stop_id,to_stop_id,from_trip_id,transfer_type,min_transfer_time\n"
+                         "0012,0034,,0,120\n"
+                         "01,0034,,0,60\n"
+                         "0034,0012,007,2,\n"
+                         "0034,0012,7,2,\n",
+    })
+
+    fixed = gtfs_consistency.fix_transfer_stops(gtfs_zip)
+
+    # "01" is not stop "1" and "7" is not trip "007", so only those transfers are removed
+    assert fixed.decode() == ("from_stop_id,to_stop_id,from_trip_id,transfer_type,min_transfer_time\n"
+                              "0012,0034,,0,120\n"
+                              "0034,0012,007,2,\n")
+
+
+def test_fix_transfer_stops_unchanged():
+    gtfs_zip = _gtfs_zip({
+        "stops.txt": "stop_id\n0012\n0034\n",
+        "trips.txt": "trip_id\n",
+        "routes.txt": "route_id\n",
+        "transfers.txt": "from_stop_id,to_stop_id\n0012,0034\n",
+    })
+
+    assert gtfs_consistency.fix_transfer_stops(gtfs_zip) is None